@@ -1,10 +1,10 @@
 #!/usr/bin/env python3
 """peacock_build_lanes.py - Build virtual lanes from events"""
-import os, argparse, json, sqlite3
+import os, argparse, heapq, sqlite3
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import List, Optional, Tuple
 
 PADDING_MINUTES = int(os.getenv("PEACOCK_PADDING_MINUTES", "45"))
 PLACEHOLDER_BLOCK_MINUTES = int(os.getenv("PEACOCK_PLACEHOLDER_BLOCK_MINUTES", "60"))
@@ -26,62 +26,37 @@ class Event:
 def ms_to_dt(ts_ms: int) -> datetime:
     return datetime.fromtimestamp(ts_ms/1000, tz=timezone.utc)
 
-def derive_times_from_attrs(attrs: Dict[str, Any]) -> Tuple[Optional[int], Optional[int], Optional[int]]:
-    start_ms, end_ms, runtime_secs = attrs.get("displayStartTime"), attrs.get("displayEndTime"), attrs.get("runtime")
-    runtime_seconds = None
-    if isinstance(runtime_secs, (int, float)):
-        runtime_seconds = int(runtime_secs)
-    elif isinstance(runtime_secs, str):
-        try:
-            parts = runtime_secs.split(":")
-            if len(parts) == 3:
-                h, m, s = map(int, parts)
-                runtime_seconds = h*3600 + m*60 + s
-        except:
-            pass
-    if start_ms and not end_ms and runtime_seconds:
-        end_ms = start_ms + runtime_seconds*1000
-    formats = attrs.get("formats") or {}
-    if isinstance(formats, dict):
-        for fmt_data in formats.values():
-            avail = (fmt_data or {}).get("availability") or {}
-            if not start_ms:
-                start_ms = avail.get("offerStartTs")
-            if not end_ms and not runtime_seconds:
-                end_ms = avail.get("offerEndTs")
-    return start_ms, end_ms, runtime_seconds
-
 def load_future_events(conn: sqlite3.Connection, days_ahead: int) -> List[Event]:
-    now, cutoff = datetime.now(timezone.utc), datetime.now(timezone.utc) + timedelta(days=days_ahead)
+    # Window checks and end/padding math stay in integer milliseconds;
+    # datetimes are only built for events that survive the filter.
+    now_ms = datetime.now(timezone.utc).timestamp() * 1000
+    cutoff_ms = now_ms + days_ahead * 86_400_000
+    padding_ms = PADDING_MINUTES * 60_000
+    fake = sorted(FAKE_CHANNELS)
     cur = conn.cursor()
-    cur.execute("SELECT id, pvid, slug, title, channel_name, raw_attributes_json FROM events WHERE pvid IS NOT NULL")
+    # start_ms/end_ms/runtime_secs are derived from the raw attributes at ingest
+    # (formats/offer fallbacks included), so raw_attributes_json is never read here
+    cur.execute(
+        f"""SELECT id, pvid, slug, title, channel_name, start_ms, end_ms, runtime_secs
+        FROM events
+        WHERE pvid IS NOT NULL
+          AND start_ms BETWEEN ? AND ?
+          AND (channel_name IS NULL OR channel_name NOT IN ({",".join("?" * len(fake))}))
+        ORDER BY start_ms""",
+        (now_ms, cutoff_ms, *fake),
+    )
     
     events: List[Event] = []
     for row in cur.fetchall():
-        event_id, pvid, slug, title, channel_name, raw_json = row
-        if channel_name in FAKE_CHANNELS:
-            continue
-        try:
-            attrs = json.loads(raw_json) if raw_json else {}
-        except:
-            attrs = {}
-        
-        start_ms, end_ms, runtime_secs = derive_times_from_attrs(attrs)
+        event_id, pvid, slug, title, channel_name, start_ms, end_ms, runtime_secs = row
         if not start_ms:
             continue
-        start_dt = ms_to_dt(start_ms)
-        if start_dt < now or start_dt > cutoff:
-            continue
-        
-        if end_ms:
-            end_dt = ms_to_dt(end_ms)
-        else:
-            end_dt = start_dt + timedelta(seconds=runtime_secs if runtime_secs else 7200)
+        if not end_ms:
+            end_ms = start_ms + (runtime_secs if runtime_secs else 7200) * 1000
         
-        end_padded = end_dt + timedelta(minutes=PADDING_MINUTES)
-        events.append(Event(event_id, pvid, slug, title, channel_name, start_dt, end_padded))
+        events.append(Event(event_id, pvid, slug, title, channel_name,
+                            ms_to_dt(start_ms), ms_to_dt(end_ms + padding_ms)))
     
-    events.sort(key=lambda e: e.start)
     return events
 
 def ensure_lane_schema(conn: sqlite3.Connection):
@@ -98,6 +73,14 @@ def ensure_lane_schema(conn: sqlite3.Connection):
         end_utc TEXT,
         title TEXT,
         PRIMARY KEY (lane_id, event_id, start_utc))""")
+    # Lets exports read lane_events in (lane_id, start_utc) order without a temp sort
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_lane_events_lane_start ON lane_events(lane_id, start_utc)")
+    # Covers the hybrid exporter's "real events overlapping now..window" scan and join key
+    cur.execute("""CREATE INDEX IF NOT EXISTS ix_lane_events_real_window
+        ON lane_events(start_utc, end_utc, event_id) WHERE is_placeholder = 0""")
+    # Covering index for the server's per-lane current/next deeplink lookup
+    cur.execute("""CREATE INDEX IF NOT EXISTS ix_lane_events_lane_live
+        ON lane_events(lane_id, is_placeholder, start_utc, end_utc, event_id)""")
     conn.commit()
 
 def reset_lanes(conn: sqlite3.Connection):
@@ -116,6 +99,29 @@ def create_lanes(conn: sqlite3.Connection, lane_count: int):
         )
     conn.commit()
 
+def placeholder_rows(lane_id: int, start: datetime, end: datetime) -> List[Tuple]:
+    """lane_events rows filling [start, end) with PLACEHOLDER_BLOCK_MINUTES blocks; the last may be short"""
+    if end <= start:
+        return []
+    block = timedelta(minutes=PLACEHOLDER_BLOCK_MINUTES)
+    full = (end - start) // block
+    bounds = [start + block*i for i in range(full + 1)]
+    if bounds[-1] < end:
+        bounds.append(end)
+    # Adjacent blocks share a boundary, so each one is formatted only once
+    isos = [b.isoformat(timespec="seconds") for b in bounds]
+    return [
+        (
+            lane_id,
+            f"placeholder-{lane_id}-{isos[i] if not bounds[i].microsecond else bounds[i].isoformat()}",
+            1,
+            isos[i],
+            isos[i + 1],
+            "Nothing Scheduled",
+        )
+        for i in range(len(bounds) - 1)
+    ]
+
 def build_lanes_with_placeholders(conn: sqlite3.Connection, events: List[Event], lane_count: int):
     cur = conn.cursor()
     if not events:
@@ -136,78 +142,53 @@ def build_lanes_with_placeholders(conn: sqlite3.Connection, events: List[Event],
         minute=0, second=0, microsecond=0
     )
     
-    lane_ends = [placeholder_start_global for _ in range(lane_count)]
+    # First-fit in O(log L): busy lanes keyed by end time, free lanes by index.
+    # Events arrive sorted by start, so a lane released here stays free.
+    busy: List[Tuple[datetime, int]] = []
+    free: List[int] = list(range(lane_count))
     lane_events: List[List[Event]] = [[] for _ in range(lane_count)]
     dropped: List[Event] = []
     
     for ev in events:
-        placed = False
-        for idx in range(lane_count):
-            if lane_ends[idx] <= ev.start:
-                lane_events[idx].append(ev)
-                lane_ends[idx] = ev.end_padded
-                placed = True
-                break
-        if not placed:
+        while busy and busy[0][0] <= ev.start:
+            heapq.heappush(free, heapq.heappop(busy)[1])
+        if not free:
             dropped.append(ev)
+            continue
+        idx = heapq.heappop(free)
+        lane_events[idx].append(ev)
+        heapq.heappush(busy, (ev.end_padded, idx))
     
-    def add_placeholder(lane_id: int, start: datetime, end: datetime):
-        cur.execute(
-            "INSERT OR REPLACE INTO lane_events VALUES (?, ?, ?, ?, ?, ?)",
-            (
-                lane_id,
-                f"placeholder-{lane_id}-{start.isoformat()}",
-                1,
-                start.isoformat(timespec="seconds"),
-                end.isoformat(timespec="seconds"),
-                "Nothing Scheduled",
-            ),
-        )
-    
+    rows: List[Tuple] = []
     placeholder_count = 0
     for lane_id in range(1, lane_count + 1):
         blocks = lane_events[lane_id - 1]
         current = placeholder_start_global
         for ev in blocks:
-            if current < ev.start:
-                gap_start = current
-                while gap_start < ev.start:
-                    gap_end = min(
-                        gap_start + timedelta(minutes=PLACEHOLDER_BLOCK_MINUTES),
-                        ev.start,
-                    )
-                    if gap_end > gap_start:
-                        add_placeholder(lane_id, gap_start, gap_end)
-                        placeholder_count += 1
-                    gap_start = gap_end
-            cur.execute(
-                "INSERT OR REPLACE INTO lane_events VALUES (?, ?, ?, ?, ?, ?)",
-                (
-                    lane_id,
-                    ev.event_id,
-                    0,
-                    ev.start.isoformat(timespec="seconds"),
-                    ev.end_padded.isoformat(timespec="seconds"),
-                    ev.title,
-                ),
-            )
+            gap = placeholder_rows(lane_id, current, ev.start)
+            rows.extend(gap)
+            placeholder_count += len(gap)
+            rows.append((
+                lane_id,
+                ev.event_id,
+                0,
+                ev.start.isoformat(timespec="seconds"),
+                ev.end_padded.isoformat(timespec="seconds"),
+                ev.title,
+            ))
             current = ev.end_padded
         
-        while current < placeholder_end_global:
-            gap_end = min(
-                current + timedelta(minutes=PLACEHOLDER_BLOCK_MINUTES),
-                placeholder_end_global,
-            )
-            if gap_end > current:
-                add_placeholder(lane_id, current, gap_end)
-                placeholder_count += 1
-            current = gap_end
+        gap = placeholder_rows(lane_id, current, placeholder_end_global)
+        rows.extend(gap)
+        placeholder_count += len(gap)
     
+    # One statement for the whole plan; runs in a single implicit transaction
+    cur.executemany("INSERT OR REPLACE INTO lane_events VALUES (?, ?, ?, ?, ?, ?)", rows)
     conn.commit()
     print(f"Created {placeholder_count} placeholders")
     print(f"Dropped {len(dropped)} events")
 
-def main():
+def main(argv: Optional[List[str]] = None):
     script_dir = Path(__file__).resolve().parent
     default_db = str(script_dir.parent / 'data' / 'peacock_events.db') if script_dir.name == 'bin' else "peacock_events.db"
 
@@ -219,8 +200,10 @@ def main():
     ap.add_argument("--db", default=env_db or default_db)
     ap.add_argument("--lanes", type=int, default=int(env_lanes) if env_lanes else LANE_COUNT_DEFAULT)
     ap.add_argument("--days-ahead", type=int, default=int(env_days) if env_days else 7)
-    args = ap.parse_args()
+    args = ap.parse_args(argv)
     conn = sqlite3.connect(args.db)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
     ensure_lane_schema(conn)
     reset_lanes(conn)
     create_lanes(conn, args.lanes)
@@ -228,6 +211,8 @@ def main():
     events = load_future_events(conn, args.days_ahead)
     print(f"Loaded {len(events)} future events")
     build_lanes_with_placeholders(conn, events, args.lanes)
+    # Table is rebuilt wholesale each run; refresh planner stats for the exporters
+    conn.execute("ANALYZE lane_events")
     
     conn.close()
     print("Lane planning complete")
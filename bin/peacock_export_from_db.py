@@ -1,20 +1,58 @@
 #!/usr/bin/env python3
 """peacock_export_from_db.py - Export lanes to XMLTV and M3U"""
-import os, argparse, json, sqlite3, urllib.parse
-import xml.etree.ElementTree as ET
-from xml.dom import minidom
+import os, argparse, bisect, functools, json, sqlite3, urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
+from operator import itemgetter
 from typing import Dict, List, Optional, Tuple
 
+# minidom's escaping, which earlier output used: quotes become &quot; in text
+# too, and attributes are always double-quoted
+XML_ESCAPES = {'"': "&quot;"}
+
+# Programme shapes are fixed: placeholders only vary by channel/time, real
+# events by a few escaped fragments, so each is one format call
+PLACEHOLDER_TPL = (
+    '  <programme channel="peacock.lane.{lane_id}" start="{start}" stop="{stop}">\n'
+    '    <title>Nothing Scheduled</title>\n'
+    '  </programme>\n'
+)
+PROGRAMME_TPL = (
+    '  <programme channel="peacock.lane.{lane_id}" start="{start}" stop="{stop}">\n'
+    '    <title>{title}</title>\n'
+    '{desc}'
+    '    <category>Sports</category>\n'
+    '    <category>Sports event</category>\n'
+    '{categories}'
+    '{icon}'
+    '    <live>1</live>\n'
+    '  </programme>\n'
+)
+
+# Deeplink payload is always {"pvid":<pvid>,"type":"PROGRAMME","action":"PLAY"};
+# only the pvid varies, so the rest is percent-encoded once here
+DEEPLINK_HEAD = "https://www.peacocktv.com/deeplink?deeplinkData=" + urllib.parse.quote('{"pvid":', safe="")
+DEEPLINK_TAIL = urllib.parse.quote(',"type":"PROGRAMME","action":"PLAY"}', safe="")
+
+def build_deeplink(pvid: str) -> str:
+    return f"{DEEPLINK_HEAD}{urllib.parse.quote(json.dumps(pvid), safe='')}{DEEPLINK_TAIL}"
+
 def get_conn(db_path: str) -> sqlite3.Connection:
     conn = sqlite3.connect(db_path)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-64000")
     return conn
 
 def check_tables(conn: sqlite3.Connection, required: List[str]) -> Tuple[bool, List[str]]:
     cur = conn.cursor()
-    cur.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    cur.execute(
+        f"SELECT name FROM sqlite_master WHERE type='table' AND name IN ({','.join('?' * len(required))})",
+        required,
+    )
     existing = {row["name"] for row in cur.fetchall()}
     missing = [t for t in required if t not in existing]
     return (len(missing) == 0, missing)
@@ -24,7 +62,7 @@ def get_lanes(conn: sqlite3.Connection) -> List[Tuple[int, str, int]]:
     cur.execute("SELECT lane_id, name, logical_number FROM lanes ORDER BY lane_id")
     return [(row["lane_id"], row["name"], row["logical_number"]) for row in cur.fetchall()]
 
-def get_lane_events(conn: sqlite3.Connection) -> List[Dict]:
+def get_lane_events(conn: sqlite3.Connection) -> List[sqlite3.Row]:
     cur = conn.cursor()
     cur.execute("""
         SELECT le.lane_id, le.event_id, le.is_placeholder, le.start_utc, le.end_utc, le.title,
@@ -34,7 +72,8 @@ def get_lane_events(conn: sqlite3.Connection) -> List[Dict]:
         LEFT JOIN events e ON le.event_id = e.id
         ORDER BY le.lane_id, le.start_utc
     """)
-    return [dict(row) for row in cur.fetchall()]
+    # sqlite3.Row already gives named access; LEFT JOIN misses read back as None
+    return cur.fetchall()
 
 def parse_iso(dt_str: str) -> datetime:
     if not dt_str:
@@ -42,142 +81,127 @@ def parse_iso(dt_str: str) -> datetime:
     dt = datetime.fromisoformat(dt_str.replace("Z", "+00:00"))
     return dt.astimezone(timezone.utc) if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
 
+@functools.lru_cache(maxsize=None)
+def parse_iso_cached(dt_str: str) -> datetime:
+    """parse_iso memoized per distinct string; lanes share many boundaries"""
+    return parse_iso(dt_str)
+
 def xmltv_time(dt: datetime) -> str:
-    return dt.astimezone(timezone.utc).strftime("%Y%m%d%H%M%S +0000")
+    # Callers pass UTC datetimes from parse_iso
+    return f"{dt.year:04d}{dt.month:02d}{dt.day:02d}{dt.hour:02d}{dt.minute:02d}{dt.second:02d} +0000"
 
-def get_event_images(conn: sqlite3.Connection, event_id: str, preferred_types: List[str]) -> Optional[str]:
-    if not event_id:
-        return None
+def iso_to_xmltv(dt_str: str) -> str:
+    """XMLTV time straight from a stored 'YYYY-MM-DDTHH:MM:SS+00:00' string"""
+    if len(dt_str) == 25 and dt_str.endswith("+00:00"):
+        return f"{dt_str[0:4]}{dt_str[5:7]}{dt_str[8:10]}{dt_str[11:13]}{dt_str[14:16]}{dt_str[17:19]} +0000"
+    return xmltv_time(parse_iso_cached(dt_str))
+
+def get_event_image_map(conn: sqlite3.Connection, preferred_types: List[str]) -> Dict[str, str]:
+    """Best image URL per event_id in one query: first preferred type, else any"""
+    rank = {img_type: i for i, img_type in enumerate(preferred_types)}
+    fallback = len(preferred_types)
     cur = conn.cursor()
-    for img_type in preferred_types:
-        cur.execute("SELECT url FROM event_images WHERE event_id=? AND img_type=? LIMIT 1", (event_id, img_type))
-        row = cur.fetchone()
-        if row:
-            return row["url"]
-    cur.execute("SELECT url FROM event_images WHERE event_id=? LIMIT 1", (event_id,))
-    row = cur.fetchone()
-    return row["url"] if row else None
+    cur.execute("SELECT event_id, img_type, url FROM event_images ORDER BY event_id, img_type, url")
+    best: Dict[str, Tuple[int, str]] = {}
+    for event_id, img_type, url in cur.fetchall():
+        r = rank.get(img_type, fallback)
+        seen = best.get(event_id)
+        if seen is None or r < seen[0]:
+            best[event_id] = (r, url)
+    return {event_id: url for event_id, (_, url) in best.items()}
 
-def build_xmltv(conn: sqlite3.Connection, xml_path: str):
-    lanes = get_lanes(conn)
-    lane_events = get_lane_events(conn)
+def build_xmltv(xml_path: str, lanes: List[Tuple[int, str, int]], lane_events: List[sqlite3.Row], images: Dict[str, str]):
     print(f"XMLTV: {len(lanes)} lanes, {len(lane_events)} events")
     
-    events_by_lane: Dict[int, List[Dict]] = {}
+    events_by_lane: Dict[int, List[sqlite3.Row]] = {}
     for row in lane_events:
         events_by_lane.setdefault(row["lane_id"], []).append(row)
     
-    tv = ET.Element("tv")
-    
-    for lane_id, name, logical_number in lanes:
-        chan = ET.SubElement(tv, "channel", id=f"peacock.lane.{lane_id}")
-        dn = ET.SubElement(chan, "display-name")
-        dn.text = f"{name} ({logical_number})"
-    
-    for lane_id, name, logical_number in lanes:
-        rows = events_by_lane.get(lane_id, [])
-        if not rows:
-            continue
+    with open(xml_path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" ?>\n<tv>\n')
         
-        for row in rows:
-            start = parse_iso(row["start_utc"])
-            stop = parse_iso(row["end_utc"])
-            if stop <= start:
-                stop = start + timedelta(minutes=1)
-            
-            prog = ET.SubElement(
-                tv, "programme",
-                channel=f"peacock.lane.{lane_id}",
-                start=xmltv_time(start),
-                stop=xmltv_time(stop)
+        for lane_id, name, logical_number in lanes:
+            f.write(
+                f'  <channel id="peacock.lane.{lane_id}">\n'
+                f'    <display-name>{escape(f"{name} ({logical_number})", XML_ESCAPES)}</display-name>\n'
+                f'  </channel>\n'
             )
+        
+        for lane_id, name, logical_number in lanes:
+            rows = events_by_lane.get(lane_id, [])
+            if not rows:
+                continue
             
-            is_placeholder = bool(row["is_placeholder"])
-            
-            # Title
-            if is_placeholder:
-                title_text = "Nothing Scheduled"
-            else:
-                title_text = row.get("event_title") or row.get("title") or "Peacock Sports"
-            
-            title_el = ET.SubElement(prog, "title")
-            title_el.text = title_text
-            
-            # Description (rich synopsis)
-            if not is_placeholder:
-                desc_text = row.get("synopsis") or row.get("synopsis_brief")
-                if desc_text:
-                    desc_el = ET.SubElement(prog, "desc")
-                    desc_el.text = desc_text
-            
-            # Categories
-            if not is_placeholder:
-                cat1 = ET.SubElement(prog, "category")
-                cat1.text = "Sports"
+            for row in rows:
+                start = parse_iso_cached(row["start_utc"])
+                if parse_iso_cached(row["end_utc"]) <= start:
+                    stop_str = xmltv_time(start + timedelta(minutes=1))
+                else:
+                    stop_str = iso_to_xmltv(row["end_utc"])
+                
+                start_str = iso_to_xmltv(row["start_utc"])
+                
+                if row["is_placeholder"]:
+                    f.write(PLACEHOLDER_TPL.format(lane_id=lane_id, start=start_str, stop=stop_str))
+                    continue
                 
-                cat2 = ET.SubElement(prog, "category")
-                cat2.text = "Sports event"
+                title_text = row["event_title"] or row["title"] or "Peacock Sports"
                 
-                # Add genres from JSON
-                genres_json = row.get("genres_json")
+                # Description (rich synopsis)
+                desc_text = row["synopsis"] or row["synopsis_brief"]
+                desc = f"    <desc>{escape(desc_text, XML_ESCAPES)}</desc>\n" if desc_text else ""
+                
+                # Extra categories: genres from JSON, then channel
+                categories = ""
+                genres_json = row["genres_json"]
                 if genres_json:
                     try:
                         genres = json.loads(genres_json)
                         if isinstance(genres, list):
-                            for g in genres:
-                                if g:
-                                    cat_el = ET.SubElement(prog, "category")
-                                    cat_el.text = str(g)
+                            categories = "".join(f"    <category>{escape(str(g), XML_ESCAPES)}</category>\n" for g in genres if g)
                     except:
                         pass
+                if row["channel_name"]:
+                    categories += f"    <category>{escape(row['channel_name'], XML_ESCAPES)}</category>\n"
                 
-                # Add channel as category if available
-                if row.get("channel_name"):
-                    cat_ch = ET.SubElement(prog, "category")
-                    cat_ch.text = row["channel_name"]
-            
-            # Icon/Image
-            if not is_placeholder and row.get("event_id"):
-                img_url = get_event_images(
-                    conn,
-                    row["event_id"],
-                    ["landscape", "scene169", "titleArt169", "scene34"]
-                )
-                if img_url:
-                    icon = ET.SubElement(prog, "icon")
-                    icon.set("src", img_url)
-            
-            # Live flag
-            if not is_placeholder:
-                live = ET.SubElement(prog, "live")
-                live.text = "1"
-    
-    xml_str = minidom.parseString(ET.tostring(tv)).toprettyxml(indent="  ")
-    with open(xml_path, "w", encoding="utf-8") as f:
-        f.write(xml_str)
+                # Icon/Image
+                img_url = images.get(row["event_id"]) if row["event_id"] else None
+                icon = f'    <icon src="{escape(img_url, XML_ESCAPES)}"/>\n' if img_url else ""
+                
+                f.write(PROGRAMME_TPL.format(
+                    lane_id=lane_id,
+                    start=start_str,
+                    stop=stop_str,
+                    title=escape(title_text, XML_ESCAPES),
+                    desc=desc,
+                    categories=categories,
+                    icon=icon,
+                ))
+        
+        f.write("</tv>\n")
     print(f"Wrote XMLTV: {xml_path}")
 
-def build_m3u(conn: sqlite3.Connection, m3u_path: str):
-    lanes = get_lanes(conn)
-    lane_events = get_lane_events(conn)
+def build_m3u(m3u_path: str, lanes: List[Tuple[int, str, int]], lane_events: List[sqlite3.Row]):
     print(f"M3U: {len(lanes)} lanes, {len(lane_events)} events")
     
-    events_by_lane: Dict[int, List[Dict]] = {}
+    events_by_lane: Dict[int, List[sqlite3.Row]] = {}
     for row in lane_events:
         events_by_lane.setdefault(row["lane_id"], []).append(row)
     
     now = datetime.now(timezone.utc)
     all_rows = [row for rows in events_by_lane.values() for row in rows]
-    real_rows = [r for r in all_rows if not r["is_placeholder"] and r.get("pvid")]
-    real_rows_sorted = sorted(real_rows, key=lambda r: parse_iso(r.get("start_utc") or ""))
+    real_rows = [r for r in all_rows if not r["is_placeholder"] and r["pvid"]]
+    real_rows_keyed = sorted(
+        ((parse_iso_cached(r["start_utc"] or ""), r) for r in real_rows),
+        key=itemgetter(0),
+    )
+    real_rows_sorted = [r for _, r in real_rows_keyed]
     
     global_upcoming = None
-    for r in real_rows_sorted:
-        start_dt = parse_iso(r.get("start_utc") or "")
-        if start_dt >= now:
-            global_upcoming = r
-            break
-    if not global_upcoming and real_rows_sorted:
+    i = bisect.bisect_left(real_rows_keyed, now, key=itemgetter(0))
+    if i < len(real_rows_sorted):
+        global_upcoming = real_rows_sorted[i]
+    elif real_rows_sorted:
         global_upcoming = real_rows_sorted[0]
     
     if not global_upcoming:
@@ -189,34 +213,23 @@ def build_m3u(conn: sqlite3.Connection, m3u_path: str):
     with open(m3u_path, "w", encoding="utf-8") as f:
         f.write("#EXTM3U\n\n")
         for lane_id, name, logical_number in lanes:
-            rows = events_by_lane.get(lane_id, [])
+            # Lane rows come from the DB ordered by start_utc, so bisect applies
+            lane_real = [r for r in events_by_lane.get(lane_id, []) if not r["is_placeholder"]]
             upcoming_real = None
-            if rows:
-                for row in rows:
-                    if row["is_placeholder"]:
-                        continue
-                    start_iso = row["start_utc"]
-                    if start_iso and parse_iso(start_iso) >= now:
-                        upcoming_real = row
-                        break
-                if not upcoming_real:
-                    for row in rows:
-                        if not row["is_placeholder"]:
-                            upcoming_real = row
-                            break
+            if lane_real:
+                i = bisect.bisect_left(lane_real, now, key=lambda r: parse_iso_cached(r["start_utc"] or ""))
+                upcoming_real = lane_real[i] if i < len(lane_real) else lane_real[0]
             if not upcoming_real:
                 upcoming_real = global_upcoming
             
             if not upcoming_real:
                 continue
             
-            pvid = upcoming_real.get("pvid")
+            pvid = upcoming_real["pvid"]
             if not pvid:
                 continue
             
-            deeplink_payload = {"pvid": pvid, "type": "PROGRAMME", "action": "PLAY"}
-            deeplink_json = json.dumps(deeplink_payload, separators=(",", ":"))
-            deeplink_url = f"https://www.peacocktv.com/deeplink?deeplinkData={urllib.parse.quote(deeplink_json, safe='')}"
+            deeplink_url = build_deeplink(pvid)
             
             f.write(
                 f'#EXTINF:-1 tvg-id="peacock.lane.{lane_id}" '
@@ -228,7 +241,7 @@ def build_m3u(conn: sqlite3.Connection, m3u_path: str):
     
     print(f"Wrote M3U: {m3u_path}")
 
-def main():
+def main(argv: Optional[List[str]] = None):
     script_dir = Path(__file__).resolve().parent
     if script_dir.name == 'bin':
         repo_root = script_dir.parent
@@ -248,7 +261,7 @@ def main():
     ap.add_argument("--db", default=env_db or default_db)
     ap.add_argument("--xml", default=env_xml or default_xml)
     ap.add_argument("--m3u", default=env_m3u or default_m3u)
-    args = ap.parse_args()
+    args = ap.parse_args(argv)
     
     Path(args.xml).parent.mkdir(parents=True, exist_ok=True)
     Path(args.m3u).parent.mkdir(parents=True, exist_ok=True)
@@ -264,9 +277,20 @@ def main():
         print("\nRun: ./bin/peacock_refresh_all.py")
         return 1
     
-    build_xmltv(conn, args.xml)
-    build_m3u(conn, args.m3u)
+    # Both outputs are built from the same snapshot; all DB reads happen here,
+    # so the builders can run side by side without sharing the connection
+    lanes = get_lanes(conn)
+    lane_events = get_lane_events(conn)
+    images = get_event_image_map(conn, ["landscape", "scene169", "titleArt169", "scene34"])
     conn.close()
+    
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        futures = [
+            ex.submit(build_xmltv, args.xml, lanes, lane_events, images),
+            ex.submit(build_m3u, args.m3u, lanes, lane_events),
+        ]
+        for fut in futures:
+            fut.result()
     print("Export complete")
     return 0
 
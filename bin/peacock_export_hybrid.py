@@ -14,16 +14,70 @@ Generates:
    - Channels match between XML and M3U
 """
 
-import os, argparse, json, sqlite3, urllib.parse
-import xml.etree.ElementTree as ET
-from xml.dom import minidom
+import os, argparse, contextlib, functools, json, sqlite3, urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# minidom's escaping, which earlier output used: quotes become &quot; in text
+# too, and attributes are always double-quoted
+XML_ESCAPES = {'"': "&quot;"}
+
+# Real programmes share one shape in both XMLTV builders; the optional
+# fragments arrive pre-escaped (or empty) so each programme is one write
+PROGRAMME_TPL = (
+    '  <programme channel="{channel}" start="{start}" stop="{stop}">\n'
+    '    <title>{title}</title>\n'
+    '{desc}'
+    '    <category>Sports</category>\n'
+    '{categories}'
+    '{icon}'
+    '    <live>1</live>\n'
+    '  </programme>\n'
+)
+
+# Everything after a placeholder's stop time, for the fixed-title lane blocks
+LANE_PLACEHOLDER_TAIL = '">\n    <title>Nothing Scheduled</title>\n  </programme>\n'
+
+# Quoted deeplinkData around the pvid; only the pvid itself varies per event
+DEEPLINK_HEAD = "https://www.peacocktv.com/deeplink?deeplinkData=" + urllib.parse.quote('{"pvid":', safe="")
+DEEPLINK_TAIL = urllib.parse.quote(',"type":"PROGRAMME","action":"PLAY"}', safe="")
+
+def build_deeplink(pvid: str) -> str:
+    return f"{DEEPLINK_HEAD}{urllib.parse.quote(json.dumps(pvid), safe='')}{DEEPLINK_TAIL}"
+
+# Display zone for placeholder descriptions; fixed EST if the image has no tz database
+try:
+    EASTERN = ZoneInfo("America/New_York")
+except ZoneInfoNotFoundError:
+    EASTERN = timezone(timedelta(hours=-5), "EST")
+
+# EXTINF lines: attribute values can't carry a bare quote, and no field may break the line
+M3U_ATTR_TBL = str.maketrans({'"': "&quot;", "\n": " ", "\r": " "})
+M3U_NAME_TBL = str.maketrans({"\n": " ", "\r": " "})
+
+@contextlib.contextmanager
+def open_output(path: str):
+    """Write to path via a temp file swapped in on success, so readers never see a partial file"""
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8", newline="\n", buffering=1 << 20) as f:
+            yield f
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 def get_conn(db_path: str) -> sqlite3.Connection:
     conn = sqlite3.connect(db_path)
     conn.row_factory = sqlite3.Row
+    # Read-only export: journal mode (WAL) is set by the lane builder that writes the DB
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-64000")
     return conn
 
 def check_tables(conn: sqlite3.Connection, required: List[str]) -> Tuple[bool, List[str]]:
@@ -50,23 +104,27 @@ def get_lane_events(conn: sqlite3.Connection) -> List[Dict]:
     """)
     return [dict(row) for row in cur.fetchall()]
 
-def get_direct_events(conn: sqlite3.Connection, hours_window: int = 24) -> List[Dict]:
+def get_direct_events(conn: sqlite3.Connection, now: datetime, hours_window: int = 24) -> List[Dict]:
     """Get events starting within the next X hours"""
     cur = conn.cursor()
-    now = datetime.now(timezone.utc)
     window_end = now + timedelta(hours=hours_window)
     
+    # One row per event: its earliest lane slot inside the window
     cur.execute("""
         SELECT e.id, e.pvid, e.slug, e.title, e.channel_name,
                e.synopsis, e.synopsis_brief, e.genres_json,
                le.start_utc, le.end_utc
-        FROM events e
-        JOIN lane_events le ON e.id = le.event_id
-        WHERE le.is_placeholder = 0
+        FROM (
+            SELECT event_id, start_utc, end_utc,
+                   ROW_NUMBER() OVER (PARTITION BY event_id ORDER BY start_utc) AS rn
+            FROM lane_events
+            WHERE is_placeholder = 0
+              AND start_utc <= ?
+              AND end_utc > ?
+        ) le
+        JOIN events e ON le.event_id = e.id
+        WHERE le.rn = 1
           AND e.pvid IS NOT NULL
-          AND le.start_utc <= ?
-          AND le.end_utc > ?
-        GROUP BY e.id
         ORDER BY le.start_utc
     """, (window_end.isoformat(), now.isoformat()))
     
@@ -75,365 +133,285 @@ def get_direct_events(conn: sqlite3.Connection, hours_window: int = 24) -> List[
 def parse_iso(dt_str: str) -> datetime:
     if not dt_str:
         return datetime.max.replace(tzinfo=timezone.utc)
+    # lane_events stores 'YYYY-MM-DDTHH:MM:SS+00:00'; slice that shape directly
+    if len(dt_str) == 25 and dt_str[10] == "T" and dt_str.endswith("+00:00"):
+        return datetime(int(dt_str[0:4]), int(dt_str[5:7]), int(dt_str[8:10]),
+                         int(dt_str[11:13]), int(dt_str[14:16]), int(dt_str[17:19]), tzinfo=timezone.utc)
     dt = datetime.fromisoformat(dt_str.replace("Z", "+00:00"))
     return dt.astimezone(timezone.utc) if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
 
 def snap_to_half_hour(dt: datetime) -> datetime:
-    """Snap datetime to nearest :00 or :30"""
-    if dt.minute < 15:
-        return dt.replace(minute=0, second=0, microsecond=0)
-    elif dt.minute < 45:
-        return dt.replace(minute=30, second=0, microsecond=0)
-    else:
-        # Round up to next hour
-        return (dt + timedelta(hours=1)).replace(minute=0, second=0, microsecond=0)
+    """Snap UTC datetime to nearest :00 or :30 (:15 and :45 round up)"""
+    ts = int(dt.timestamp())
+    return datetime.fromtimestamp((ts + 900) // 1800 * 1800, tz=timezone.utc)
 
 def xmltv_time(dt: datetime) -> str:
-    return dt.astimezone(timezone.utc).strftime("%Y%m%d%H%M%S +0000")
+    # Every caller holds a UTC datetime (parse_iso output or arithmetic on one)
+    return f"{dt.year:04d}{dt.month:02d}{dt.day:02d}{dt.hour:02d}{dt.minute:02d}{dt.second:02d} +0000"
+
+def iso_to_xmltv(dt_str: str) -> str:
+    """XMLTV time from a stored lane_events timestamp without building a datetime"""
+    if len(dt_str) == 25 and dt_str[10] == "T" and dt_str.endswith("+00:00"):
+        return f"{dt_str[0:4]}{dt_str[5:7]}{dt_str[8:10]}{dt_str[11:13]}{dt_str[14:16]}{dt_str[17:19]} +0000"
+    return xmltv_time(parse_iso(dt_str))
 
-def format_local_time(dt: datetime) -> str:
-    """Format datetime in local time for display"""
-    # Convert to US Eastern Time (you can change this to your timezone)
-    from datetime import timezone as tz
-    # EST is UTC-5, EDT is UTC-4
-    # For simplicity, using a fixed offset. In production, use pytz or zoneinfo
-    eastern_offset = timedelta(hours=-5)  # Adjust for your timezone
-    local_dt = dt + eastern_offset
-    return local_dt.strftime('%I:%M %p EST')
+def half_hour_blocks(start: datetime, end: datetime) -> List[Tuple[datetime, datetime]]:
+    """30-minute (start, stop) blocks covering [start, end); a final block under a minute is dropped"""
+    if end <= start:
+        return []
+    block = timedelta(minutes=30)
+    full, rest = divmod(end - start, block)
+    blocks = [(start + block*i, start + block*(i + 1)) for i in range(full)]
+    if rest >= timedelta(minutes=1):
+        blocks.append((start + block*full, end))
+    return blocks
 
-def get_event_images(conn: sqlite3.Connection, event_id: str, preferred_types: List[str]) -> Optional[str]:
-    if not event_id:
-        return None
+@functools.lru_cache(maxsize=None)
+def genre_categories(genres_json: str) -> str:
+    """<category> lines for a genres_json value; events share a handful of distinct values"""
+    try:
+        genres = json.loads(genres_json)
+    except:
+        return ""
+    if not isinstance(genres, list):
+        return ""
+    return "".join(f"    <category>{escape(str(g), XML_ESCAPES)}</category>\n" for g in genres if g)
+
+def get_event_image_map(conn: sqlite3.Connection, preferred_types: List[str]) -> Dict[str, str]:
+    """Best image URL per event_id in one query: first preferred type, else any"""
+    rank = {img_type: i for i, img_type in enumerate(preferred_types)}
+    fallback = len(preferred_types)
     cur = conn.cursor()
-    for img_type in preferred_types:
-        cur.execute("SELECT url FROM event_images WHERE event_id=? AND img_type=? LIMIT 1", (event_id, img_type))
-        row = cur.fetchone()
-        if row:
-            return row["url"]
-    cur.execute("SELECT url FROM event_images WHERE event_id=? LIMIT 1", (event_id,))
-    row = cur.fetchone()
-    return row["url"] if row else None
+    cur.execute("SELECT event_id, img_type, url FROM event_images ORDER BY event_id, img_type, url")
+    best: Dict[str, Tuple[int, str]] = {}
+    for event_id, img_type, url in cur.fetchall():
+        r = rank.get(img_type, fallback)
+        seen = best.get(event_id)
+        if seen is None or r < seen[0]:
+            best[event_id] = (r, url)
+    return {event_id: url for event_id, (_, url) in best.items()}
 
-def build_adbtuner_xmltv(conn: sqlite3.Connection, xml_path: str):
+def build_adbtuner_xmltv(xml_path: str, lanes: List[Tuple[int, str, int]], lane_events: List[Dict], images: Dict[str, str]):
     """Build lane-based XMLTV for ADBTuner"""
-    lanes = get_lanes(conn)
-    lane_events = get_lane_events(conn)
     print(f"ADBTuner XMLTV: {len(lanes)} lanes, {len(lane_events)} events")
     
     events_by_lane: Dict[int, List[Dict]] = {}
     for row in lane_events:
         events_by_lane.setdefault(row["lane_id"], []).append(row)
     
-    tv = ET.Element("tv")
-    tv.set("generator-info-name", "Peacock TV Scraper")
-    tv.set("generator-info-url", "https://github.com/kineticman/PeacockDeepLinks")
-    
-    # Channels
-    for lane_id, name, logical_number in lanes:
-        chan = ET.SubElement(tv, "channel", id=f"peacock.lane.{lane_id}")
-        dn = ET.SubElement(chan, "display-name")
-        dn.text = f"{name} ({logical_number})"
-    
-    # Programs
-    for lane_id, name, logical_number in lanes:
-        rows = events_by_lane.get(lane_id, [])
-        if not rows:
-            continue
+    with open_output(xml_path) as f:
+        f.write(
+            '<?xml version="1.0" ?>\n'
+            '<tv generator-info-name="Peacock TV Scraper" '
+            'generator-info-url="https://github.com/kineticman/PeacockDeepLinks">\n'
+        )
         
-        for row in rows:
-            start = parse_iso(row["start_utc"])
-            stop = parse_iso(row["end_utc"])
-            if stop <= start:
-                stop = start + timedelta(minutes=1)
-            
-            prog = ET.SubElement(
-                tv, "programme",
-                channel=f"peacock.lane.{lane_id}",
-                start=xmltv_time(start),
-                stop=xmltv_time(stop)
+        # Channels
+        for lane_id, name, logical_number in lanes:
+            f.write(
+                f'  <channel id="peacock.lane.{lane_id}">\n'
+                f'    <display-name>{escape(f"{name} ({logical_number})", XML_ESCAPES)}</display-name>\n'
+                f'  </channel>\n'
             )
+        
+        # Programs
+        for lane_id, name, logical_number in lanes:
+            rows = events_by_lane.get(lane_id, [])
+            if not rows:
+                continue
             
-            is_placeholder = bool(row["is_placeholder"])
-            
-            # Title
-            if is_placeholder:
-                title_text = "Nothing Scheduled"
-            else:
+            open_tag = f'  <programme channel="peacock.lane.{lane_id}" start="'
+            for row in rows:
+                # Fixed-width UTC strings, so they compare in time order
+                start = iso_to_xmltv(row["start_utc"])
+                stop = iso_to_xmltv(row["end_utc"])
+                if stop <= start:
+                    stop = xmltv_time(parse_iso(row["start_utc"]) + timedelta(minutes=1))
+                
+                if row["is_placeholder"]:
+                    f.write(f'{open_tag}{start}" stop="{stop}{LANE_PLACEHOLDER_TAIL}')
+                    continue
+                
                 title_text = row.get("event_title") or row.get("title") or "Peacock Sports"
-            
-            title_el = ET.SubElement(prog, "title")
-            title_el.text = title_text
-            
-            # Description
-            if not is_placeholder:
                 desc_text = row.get("synopsis") or row.get("synopsis_brief")
-                if desc_text:
-                    desc_el = ET.SubElement(prog, "desc")
-                    desc_el.text = desc_text
-            
-            # Categories
-            if not is_placeholder:
-                cat1 = ET.SubElement(prog, "category")
-                cat1.text = "Sports"
-                
                 genres_json = row.get("genres_json")
-                if genres_json:
-                    try:
-                        genres = json.loads(genres_json)
-                        if isinstance(genres, list):
-                            for g in genres:
-                                if g:
-                                    cat_el = ET.SubElement(prog, "category")
-                                    cat_el.text = str(g)
-                    except:
-                        pass
-            
-            # Icon
-            if not is_placeholder and row.get("event_id"):
-                img_url = get_event_images(
-                    conn, row["event_id"],
-                    ["landscape", "scene169", "titleArt169", "scene34"]
-                )
-                if img_url:
-                    icon = ET.SubElement(prog, "icon")
-                    icon.set("src", img_url)
-            
-            if not is_placeholder:
-                live = ET.SubElement(prog, "live")
-                live.text = "1"
-    
-    xml_str = minidom.parseString(ET.tostring(tv)).toprettyxml(indent="  ")
-    with open(xml_path, "w", encoding="utf-8") as f:
-        f.write(xml_str)
+                img_url = images.get(row["event_id"]) if row.get("event_id") else None
+                
+                f.write(PROGRAMME_TPL.format(
+                    channel=f"peacock.lane.{lane_id}",
+                    start=start,
+                    stop=stop,
+                    title=escape(title_text, XML_ESCAPES),
+                    desc=f"    <desc>{escape(desc_text, XML_ESCAPES)}</desc>\n" if desc_text else "",
+                    categories=genre_categories(genres_json) if genres_json else "",
+                    icon=f'    <icon src="{escape(img_url, XML_ESCAPES)}"/>\n' if img_url else "",
+                ))
+        
+        f.write("</tv>\n")
     print(f"Wrote ADBTuner XMLTV: {xml_path}")
 
-def build_adbtuner_m3u(conn: sqlite3.Connection, m3u_path: str, server_url: str):
+def build_adbtuner_m3u(m3u_path: str, lanes: List[Tuple[int, str, int]], server_url: str):
     """Build lane-based M3U for ADBTuner with API URLs"""
-    lanes = get_lanes(conn)
     print(f"ADBTuner M3U: {len(lanes)} lanes")
     
-    with open(m3u_path, "w", encoding="utf-8") as f:
-        f.write("#EXTM3U\n\n")
-        for lane_id, name, logical_number in lanes:
-            # Use configured server URL for API endpoint
-            stream_url = f"{server_url}/api/lane/{lane_id}/deeplink"
-            
-            f.write(
-                f'#EXTINF:-1 tvg-id="peacock.lane.{lane_id}" '
-                f'tvg-name="{name}" '
-                f'tvg-chno="{logical_number}" '
-                f'group-title="Peacock Lanes" tvg-logo="",{name}\n'
-            )
-            f.write(f"{stream_url}\n\n")
+    parts = ["#EXTM3U\n\n"]
+    for lane_id, name, logical_number in lanes:
+        # Use configured server URL for API endpoint
+        stream_url = f"{server_url}/api/lane/{lane_id}/deeplink"
+        
+        parts.append(
+            f'#EXTINF:-1 tvg-id="peacock.lane.{lane_id}" '
+            f'tvg-name="{name.translate(M3U_ATTR_TBL)}" '
+            f'tvg-chno="{logical_number}" '
+            f'group-title="Peacock Lanes" tvg-logo="",{name.translate(M3U_NAME_TBL)}\n'
+            f"{stream_url}\n\n"
+        )
+    
+    with open_output(m3u_path) as f:
+        f.write("".join(parts))
     
     print(f"Wrote ADBTuner M3U: {m3u_path}")
 
-def build_chrome_m3u(conn: sqlite3.Connection, m3u_path: str, server_url: str):
+def build_chrome_m3u(m3u_path: str, lanes: List[Tuple[int, str, int]], server_url: str):
     """Build Chrome Capture M3U with chrome:// API URLs for dynamic deeplinks"""
-    lanes = get_lanes(conn)
     print(f"Chrome Capture M3U: {len(lanes)} lanes")
     
-    with open(m3u_path, "w", encoding="utf-8") as f:
-        f.write("#EXTM3U\n\n")
-        for lane_id, name, logical_number in lanes:
-            # Use API endpoint wrapped in chrome:// for dynamic deeplink resolution
-            api_url = f"{server_url}/api/lane/{lane_id}/deeplink?format=text"
-            chrome_url = f"chrome://{api_url}"
-            
-            f.write(
-                f'#EXTINF:-1 tvg-id="peacock.lane.{lane_id}" '
-                f'tvg-name="{name}" '
-                f'tvg-chno="{logical_number}" '
-                f'group-title="Peacock Lanes" tvg-logo="",{name}\n'
-            )
-            f.write(f"{chrome_url}\n\n")
+    parts = ["#EXTM3U\n\n"]
+    for lane_id, name, logical_number in lanes:
+        # Use API endpoint wrapped in chrome:// for dynamic deeplink resolution
+        api_url = f"{server_url}/api/lane/{lane_id}/deeplink?format=text"
+        chrome_url = f"chrome://{api_url}"
+        
+        parts.append(
+            f'#EXTINF:-1 tvg-id="peacock.lane.{lane_id}" '
+            f'tvg-name="{name.translate(M3U_ATTR_TBL)}" '
+            f'tvg-chno="{logical_number}" '
+            f'group-title="Peacock Lanes" tvg-logo="",{name.translate(M3U_NAME_TBL)}\n'
+            f"{chrome_url}\n\n"
+        )
+    
+    with open_output(m3u_path) as f:
+        f.write("".join(parts))
     
     print(f"Wrote Chrome Capture M3U: {m3u_path}")
 
-def build_direct_xmltv(conn: sqlite3.Connection, xml_path: str):
+def build_direct_xmltv(xml_path: str, events: List[Dict], images: Dict[str, str], now: datetime):
     """Build one-channel-per-event XMLTV with placeholders"""
-    events = get_direct_events(conn, hours_window=24)
     print(f"Direct XMLTV: {len(events)} event channels (within 24 hours)")
     
-    now = datetime.now(timezone.utc)
-    
-    tv = ET.Element("tv")
-    tv.set("generator-info-name", "Peacock TV Scraper - Direct")
-    tv.set("generator-info-url", "https://github.com/kineticman/PeacockDeepLinks")
-    
-    # Create channel and program for each event with placeholders
-    for idx, event in enumerate(events, start=1):
-        chan_id = f"peacock.event.{idx}"
-        
-        # Channel definition
-        chan = ET.SubElement(tv, "channel", id=chan_id)
-        dn = ET.SubElement(chan, "display-name")
-        dn.text = event["title"] or f"Peacock Event {idx}"
-        
-        # Event times
-        event_start = parse_iso(event["start_utc"])
-        event_end = parse_iso(event["end_utc"])
-        if event_end <= event_start:
-            event_end = event_start + timedelta(hours=3)
-        
-        # Placeholder: "Event Not Started" - snap to :00 or :30
-        # Start from NOW or 8 hours before event (whichever is earlier)
-        pre_start = now
-        earliest_start = event_start - timedelta(hours=8)
-        if earliest_start < pre_start:
-            pre_start = earliest_start
-        
-        # Snap to nearest :00 or :30
-        pre_start = snap_to_half_hour(pre_start)
+    with open_output(xml_path) as f:
+        f.write(
+            '<?xml version="1.0" ?>\n'
+            '<tv generator-info-name="Peacock TV Scraper - Direct" '
+            'generator-info-url="https://github.com/kineticman/PeacockDeepLinks">\n'
+        )
         
-        # Create 30-minute placeholder blocks before event
-        current = pre_start
-        while current < event_start:
-            block_end = min(current + timedelta(minutes=30), event_start)
+        # Create channel and program for each event with placeholders
+        for idx, event in enumerate(events, start=1):
+            chan_id = f"peacock.event.{idx}"
             
-            # Skip if block would be less than 1 minute
-            if (block_end - current).total_seconds() < 60:
-                break
+            open_tag = f'  <programme channel="{chan_id}" start="'
             
-            prog = ET.SubElement(
-                tv, "programme",
-                channel=chan_id,
-                start=xmltv_time(current),
-                stop=xmltv_time(block_end)
+            # Channel definition
+            f.write(
+                f'  <channel id="{chan_id}">\n'
+                f'    <display-name>{escape(event["title"] or f"Peacock Event {idx}", XML_ESCAPES)}</display-name>\n'
+                f'  </channel>\n'
             )
             
-            title_el = ET.SubElement(prog, "title")
-            title_el.text = "Event Not Started"
+            # Event times
+            event_start = parse_iso(event["start_utc"])
+            event_end = parse_iso(event["end_utc"])
+            if event_end <= event_start:
+                event_end = event_start + timedelta(hours=3)
             
-            desc_el = ET.SubElement(prog, "desc")
-            desc_el.text = f"This event starts at {format_local_time(event_start)}. Check back closer to start time."
+            # Placeholder: "Event Not Started" - snap to :00 or :30
+            # Start from NOW or 8 hours before event (whichever is earlier)
+            pre_start = now
+            earliest_start = event_start - timedelta(hours=8)
+            if earliest_start < pre_start:
+                pre_start = earliest_start
             
-            current = block_end
-        
-        # Actual event program
-        prog = ET.SubElement(
-            tv, "programme",
-            channel=chan_id,
-            start=xmltv_time(event_start),
-            stop=xmltv_time(event_end)
-        )
-        
-        title_el = ET.SubElement(prog, "title")
-        title_el.text = event["title"] or "Peacock Sports"
-        
-        desc_text = event.get("synopsis") or event.get("synopsis_brief")
-        if desc_text:
-            desc_el = ET.SubElement(prog, "desc")
-            desc_el.text = desc_text
-        
-        cat1 = ET.SubElement(prog, "category")
-        cat1.text = "Sports"
-        
-        genres_json = event.get("genres_json")
-        if genres_json:
-            try:
-                genres = json.loads(genres_json)
-                if isinstance(genres, list):
-                    for g in genres:
-                        if g:
-                            cat_el = ET.SubElement(prog, "category")
-                            cat_el.text = str(g)
-            except:
-                pass
-        
-        if event.get("id"):
-            img_url = get_event_images(
-                conn, event["id"],
-                ["landscape", "scene169", "titleArt169", "scene34"]
-            )
-            if img_url:
-                icon = ET.SubElement(prog, "icon")
-                icon.set("src", img_url)
-        
-        live = ET.SubElement(prog, "live")
-        live.text = "1"
-        
-        # Placeholder: "Event Ended" (24 hours after event end)
-        post_end = event_end + timedelta(hours=24)
-        
-        # Snap event_end to next :00 or :30
-        current = snap_to_half_hour(event_end)
-        if current < event_end:
-            current = event_end
-        
-        # Create 30-minute placeholder blocks after event
-        while current < post_end:
-            block_end = min(current + timedelta(minutes=30), post_end)
+            # Snap to nearest :00 or :30
+            pre_start = snap_to_half_hour(pre_start)
             
-            # Skip if block would be less than 1 minute
-            if (block_end - current).total_seconds() < 60:
-                break
+            # Create 30-minute placeholder blocks before event
+            pre_tail = (
+                f'">\n    <title>Event Not Started</title>\n'
+                f"    <desc>This event starts at {event_start.astimezone(EASTERN).strftime('%I:%M %p %Z')}. "
+                f"Check back closer to start time.</desc>\n  </programme>\n"
+            )
+            for block_start, block_end in half_hour_blocks(pre_start, event_start):
+                f.write(f'{open_tag}{xmltv_time(block_start)}" stop="{xmltv_time(block_end)}{pre_tail}')
             
-            prog = ET.SubElement(
-                tv, "programme",
+            # Actual event program
+            desc_text = event.get("synopsis") or event.get("synopsis_brief")
+            genres_json = event.get("genres_json")
+            img_url = images.get(event["id"]) if event.get("id") else None
+            f.write(PROGRAMME_TPL.format(
                 channel=chan_id,
-                start=xmltv_time(current),
-                stop=xmltv_time(block_end)
-            )
+                start=xmltv_time(event_start),
+                stop=xmltv_time(event_end),
+                title=escape(event["title"] or "Peacock Sports", XML_ESCAPES),
+                desc=f"    <desc>{escape(desc_text, XML_ESCAPES)}</desc>\n" if desc_text else "",
+                categories=genre_categories(genres_json) if genres_json else "",
+                icon=f'    <icon src="{escape(img_url, XML_ESCAPES)}"/>\n' if img_url else "",
+            ))
             
-            title_el = ET.SubElement(prog, "title")
-            title_el.text = "Event Ended"
+            # Placeholder: "Event Ended" (24 hours after event end)
+            post_end = event_end + timedelta(hours=24)
             
-            desc_el = ET.SubElement(prog, "desc")
-            desc_el.text = f"This event ended at {format_local_time(event_end)}. Check guide for upcoming events."
+            # Snap event_end to next :00 or :30
+            current = snap_to_half_hour(event_end)
+            if current < event_end:
+                current = event_end
             
-            current = block_end
-    
-    xml_str = minidom.parseString(ET.tostring(tv)).toprettyxml(indent="  ")
-    with open(xml_path, "w", encoding="utf-8") as f:
-        f.write(xml_str)
+            # Create 30-minute placeholder blocks after event
+            post_tail = (
+                f'">\n    <title>Event Ended</title>\n'
+                f"    <desc>This event ended at {event_end.astimezone(EASTERN).strftime('%I:%M %p %Z')}. "
+                f"Check guide for upcoming events.</desc>\n  </programme>\n"
+            )
+            for block_start, block_end in half_hour_blocks(current, post_end):
+                f.write(f'{open_tag}{xmltv_time(block_start)}" stop="{xmltv_time(block_end)}{post_tail}')
+        
+        f.write("</tv>\n")
     print(f"Wrote Direct XMLTV: {xml_path}")
 
-def build_direct_m3u(conn: sqlite3.Connection, m3u_path: str):
+def build_direct_m3u(m3u_path: str, events: List[Dict], images: Dict[str, str]):
     """Build one-channel-per-event M3U matching the XMLTV channels"""
-    events = get_direct_events(conn, hours_window=24)
     print(f"Direct M3U: {len(events)} event channels (within 24 hours)")
     
-    with open(m3u_path, "w", encoding="utf-8") as f:
-        f.write("#EXTM3U\n\n")
+    parts = ["#EXTM3U\n\n"]
+    # get_direct_events only returns rows with a pvid, and idx must stay in
+    # step with build_direct_xmltv's channel numbering, so nothing is skipped
+    for idx, event in enumerate(events, start=1):
+        # Create actual Peacock deeplink
+        deeplink_url = build_deeplink(event["pvid"])
         
-        for idx, event in enumerate(events, start=1):
-            pvid = event.get("pvid")
-            if not pvid:
-                continue
-            
-            # Create actual Peacock deeplink
-            deeplink_payload = {"pvid": pvid, "type": "PROGRAMME", "action": "PLAY"}
-            deeplink_json = json.dumps(deeplink_payload, separators=(",", ":"))
-            deeplink_url = f"https://www.peacocktv.com/deeplink?deeplinkData={urllib.parse.quote(deeplink_json, safe='')}"
-            
-            # MUST match XMLTV channel ID
-            chan_id = f"peacock.event.{idx}"
-            title = event["title"] or f"Peacock Event {idx}"
-            
-            # Get image for tvg-logo
-            logo_url = ""
-            if event.get("id"):
-                logo_url = get_event_images(
-                    conn, event["id"],
-                    ["landscape", "scene169", "titleArt169", "scene34"]
-                ) or ""
-            
-            f.write(
-                f'#EXTINF:-1 tvg-id="{chan_id}" '
-                f'tvg-name="{title}" '
-                f'group-title="Peacock Events"'
-            )
-            
-            if logo_url:
-                f.write(f' tvg-logo="{logo_url}"')
-            
-            f.write(f',{title}\n')
-            f.write(f"{deeplink_url}\n\n")
+        # MUST match XMLTV channel ID
+        chan_id = f"peacock.event.{idx}"
+        title = event["title"] or f"Peacock Event {idx}"
+        
+        # Get image for tvg-logo
+        logo_url = ""
+        if event.get("id"):
+            logo_url = images.get(event["id"]) or ""
+        logo_attr = f' tvg-logo="{logo_url.translate(M3U_ATTR_TBL)}"' if logo_url else ""
+        
+        parts.append(
+            f'#EXTINF:-1 tvg-id="{chan_id}" '
+            f'tvg-name="{title.translate(M3U_ATTR_TBL)}" '
+            f'group-title="Peacock Events"{logo_attr},{title.translate(M3U_NAME_TBL)}\n'
+            f"{deeplink_url}\n\n"
+        )
+    
+    with open_output(m3u_path) as f:
+        f.write("".join(parts))
     
     print(f"Wrote Direct M3U: {m3u_path}")
 
-def main():
+def main(argv: Optional[List[str]] = None):
     script_dir = Path(__file__).resolve().parent
     if script_dir.name == 'bin':
         repo_root = script_dir.parent
@@ -471,7 +449,7 @@ def main():
     ap.add_argument("--direct-xml", default=env_direct_xml or default_direct_xml)
     ap.add_argument("--direct-m3u", default=env_direct_m3u or default_direct_m3u)
     ap.add_argument("--server-url", default=env_server_url, help="Server URL for API deeplink endpoints")
-    args = ap.parse_args()
+    args = ap.parse_args(argv)
     
     for path in [args.lanes_xml, args.lanes_m3u, args.chrome_m3u, args.direct_xml, args.direct_m3u]:
         Path(path).parent.mkdir(parents=True, exist_ok=True)
@@ -495,16 +473,28 @@ def main():
         print("\nRun: ./bin/peacock_refresh_all.py")
         return 1
     
-    # Build ADBTuner files (lane-based with API URLs)
-    build_adbtuner_xmltv(conn, args.lanes_xml)
-    build_adbtuner_m3u(conn, args.lanes_m3u, args.server_url)
-    build_chrome_m3u(conn, args.chrome_m3u, args.server_url)
+    # Query once; every builder below works from these snapshots
+    now = datetime.now(timezone.utc)
+    lanes = get_lanes(conn)
+    lane_events = get_lane_events(conn)
+    direct_events = get_direct_events(conn, now, hours_window=24)
+    images = get_event_image_map(conn, ["landscape", "scene169", "titleArt169", "scene34"])
+    conn.close()
     
-    # Build Direct files (one channel per event with deeplinks)
-    build_direct_xmltv(conn, args.direct_xml)
-    build_direct_m3u(conn, args.direct_m3u)
+    # Builders only read the snapshots above and each owns its output file
+    with ThreadPoolExecutor(max_workers=4) as ex:
+        futures = [
+            # ADBTuner files (lane-based with API URLs)
+            ex.submit(build_adbtuner_xmltv, args.lanes_xml, lanes, lane_events, images),
+            ex.submit(build_adbtuner_m3u, args.lanes_m3u, lanes, args.server_url),
+            ex.submit(build_chrome_m3u, args.chrome_m3u, lanes, args.server_url),
+            # Direct files (one channel per event with deeplinks)
+            ex.submit(build_direct_xmltv, args.direct_xml, direct_events, images, now),
+            ex.submit(build_direct_m3u, args.direct_m3u, direct_events, images),
+        ]
+        for fut in futures:
+            fut.result()
     
-    conn.close()
     print("\nExport complete!")
     return 0
 
@@ -1,34 +1,116 @@
 #!/usr/bin/env python3
 """peacock_ingest_atom.py - Fetch schedule from Peacock API into SQLite"""
-import os, argparse, json, sqlite3, requests
+import os, argparse, hashlib, json, sqlite3, sys, time, requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from pathlib import Path
+from types import MappingProxyType
 from typing import Any, Dict, List, Optional, Tuple
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# orjson is optional: same JSON, several times faster on the multi-MB response
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def json_loads(data: bytes) -> Any:
+    return orjson.loads(data) if orjson else json.loads(data)
+
+def json_dumps(obj: Any) -> str:
+    if orjson:
+        try:
+            return orjson.dumps(obj).decode()
+        except TypeError:
+            pass  # e.g. ints beyond 64 bits; stdlib handles those
+    return json.dumps(obj)
 
 ATOM_BASE = "https://atom.peacocktv.com/adapter-calypso/v3/query/node"
-HEADERS = {
+# Read-only: copied once into each Session; only Referer varies, per request
+HEADERS = MappingProxyType({
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
     "Accept": "application/json", "Accept-Language": "en-US,en;q=0.9",
     "Origin": "https://www.peacocktv.com", "Referer": "https://www.peacocktv.com/",
     "X-SkyOTT-Proposition": "NBCUOTT", "X-SkyOTT-Platform": "PC",
     "X-SkyOTT-Device": "005", "X-SkyOTT-Territory": "US",
     "X-SkyOTT-Language": "en", "X-SkyOTT-Provider": "NBCU",
+})
+
+# Column order of the positional tuples build_event_params returns
+EVENT_COLS = (
+    "id", "pvid", "slug", "title", "title_brief", "synopsis", "synopsis_brief",
+    "channel_name", "channel_provider_id",
+    "airing_type",
+    "is_free", "is_premium", "runtime_secs",
+    "start_ms", "end_ms", "start_utc", "end_utc",
+    "created_ms", "created_utc", "raw_attributes_json", "content_hash",
+)
+# ids per last_seen_utc UPDATE; stays under SQLite's historic 999-parameter limit
+LAST_SEEN_CHUNK = 900
+# events columns derived from raw_attributes_json rather than stored twice
+JSON_COLUMNS = {
+    "classification_json": "classification",
+    "genres_json": "genres",
+    "content_segments_json": "contentSegments",
 }
+# created_* keep the value from the first sighting
+UPDATE_COLS = [c for c in EVENT_COLS if c not in ("id", "created_ms", "created_utc")]
+UPSERT_EVENT_SQL = (
+    f"INSERT INTO events ({','.join(EVENT_COLS)}) VALUES ({','.join('?' * len(EVENT_COLS))}) "
+    f"ON CONFLICT(id) DO UPDATE SET ({','.join(UPDATE_COLS)}) = "
+    f"({','.join('excluded.' + c for c in UPDATE_COLS)})"
+)
 
 def ts_ms_to_iso(ts_ms: Optional[int]) -> Optional[str]:
-    return datetime.fromtimestamp(ts_ms/1000, tz=timezone.utc).isoformat(timespec="seconds") if ts_ms else None
+    if ts_ms is None:
+        return None
+    return time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(ts_ms // 1000))
+
+def json_column_expr(key: str) -> str:
+    """SQL for json.dumps(attrs.get(key) or []): always valid JSON text, '[]' for falsy values"""
+    path = f"raw_attributes_json, '$.{key}'"
+    # json_extract returns strings unquoted and booleans as 0/1, so those are re-encoded
+    return (
+        f"CASE WHEN json_type({path}) IN ('array', 'object') "
+        f"THEN CASE WHEN json_extract({path}) IN ('[]', '{{}}') THEN '[]' ELSE json_extract({path}) END "
+        f"WHEN json_type({path}) = 'true' THEN 'true' "
+        f"WHEN json_extract({path}) IN ('', 0) THEN '[]' "
+        f"WHEN json_type({path}) IN ('text', 'integer', 'real') THEN json_quote(json_extract({path})) "
+        f"ELSE '[]' END"
+    )
 
 def ensure_schema(conn: sqlite3.Connection):
     cur = conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute("PRAGMA temp_store=MEMORY")
+    cur.execute("PRAGMA mmap_size=268435456")
+    cur.execute("PRAGMA cache_size=-64000")
     cur.execute("""CREATE TABLE IF NOT EXISTS events (
         id TEXT PRIMARY KEY, pvid TEXT, slug TEXT, title TEXT, title_brief TEXT,
         synopsis TEXT, synopsis_brief TEXT, channel_name TEXT, channel_provider_id TEXT,
-        airing_type TEXT, classification_json TEXT, genres_json TEXT, content_segments_json TEXT,
+        airing_type TEXT,
         is_free INTEGER, is_premium INTEGER, runtime_secs INTEGER, start_ms INTEGER, end_ms INTEGER,
         start_utc TEXT, end_utc TEXT, created_ms INTEGER, created_utc TEXT,
-        last_seen_utc TEXT, raw_attributes_json TEXT)""")
+        last_seen_utc TEXT, raw_attributes_json TEXT, content_hash BLOB)""")
+    # name -> hidden flag (0 = stored column, 2/3 = generated)
+    columns = {row[1]: row[6] for row in cur.execute("PRAGMA table_xinfo(events)")}
+    if "content_hash" not in columns:
+        cur.execute("ALTER TABLE events ADD COLUMN content_hash BLOB")
+    # These are views into raw_attributes_json; older DBs stored them as separate
+    # copies, or generated them with an earlier expression
+    table_sql = cur.execute("SELECT sql FROM sqlite_master WHERE name = 'events'").fetchone()[0]
+    for column, key in JSON_COLUMNS.items():
+        expr = json_column_expr(key)
+        if column in columns and (columns[column] == 0 or expr not in table_sql):
+            cur.execute(f"ALTER TABLE events DROP COLUMN {column}")
+            columns.pop(column)
+        if column not in columns:
+            cur.execute(f"ALTER TABLE events ADD COLUMN {column} TEXT GENERATED ALWAYS AS ({expr}) VIRTUAL")
     cur.execute("""CREATE TABLE IF NOT EXISTS event_images (
         event_id TEXT, img_type TEXT, url TEXT, PRIMARY KEY (event_id, img_type, url))""")
+    cur.execute("CREATE INDEX IF NOT EXISTS ix_events_start_ms ON events(start_ms) WHERE pvid IS NOT NULL")
     conn.commit()
 
 def derive_times(attrs: Dict[str, Any]) -> Tuple[Optional[int], Optional[int], Optional[int]]:
@@ -37,13 +119,9 @@ def derive_times(attrs: Dict[str, Any]) -> Tuple[Optional[int], Optional[int], O
     if isinstance(runtime_secs, (int, float)):
         runtime_seconds = int(runtime_secs)
     elif isinstance(runtime_secs, str):
-        try:
-            parts = runtime_secs.split(":")
-            if len(parts) == 3:
-                h, m, s = map(int, parts)
-                runtime_seconds = h*3600 + m*60 + s
-        except:
-            pass
+        parts = runtime_secs.split(":")
+        if len(parts) == 3 and parts[0].isdecimal() and parts[1].isdecimal() and parts[2].isdecimal():
+            runtime_seconds = int(parts[0])*3600 + int(parts[1])*60 + int(parts[2])
     if start_ms and not end_ms and runtime_seconds:
         end_ms = start_ms + runtime_seconds*1000
     formats = attrs.get("formats") or {}
@@ -56,8 +134,12 @@ def derive_times(attrs: Dict[str, Any]) -> Tuple[Optional[int], Optional[int], O
                 end_ms = avail.get("offerEndTs")
     return start_ms, end_ms, runtime_seconds
 
-def upsert_event(conn: sqlite3.Connection, item: Dict[str, Any]):
-    cur = conn.cursor()
+def intern_str(value: Any) -> Any:
+    """Share one object per distinct small-vocabulary string (channels, airing types, image types)"""
+    return sys.intern(value) if type(value) is str else value
+
+def build_event_params(item: Dict[str, Any]) -> Tuple[Tuple, List[Tuple[str, str, str]]]:
+    """events row (EVENT_COLS order) and event_images rows for one API item; no DB work"""
     attrs = item.get("attributes") or {}
     node_id = item.get("id")
 
@@ -69,69 +151,83 @@ def upsert_event(conn: sqlite3.Connection, item: Dict[str, Any]):
     synopsis_brief = attrs.get("synopsisBrief")
     
     channel = attrs.get("channel") or {}
-    channel_name = channel.get("name")
-    channel_provider_id = channel.get("providerId")
+    channel_name = intern_str(channel.get("name"))
+    channel_provider_id = intern_str(channel.get("providerId"))
 
     start_ms, end_ms, runtime_secs = derive_times(attrs)
     start_utc = ts_ms_to_iso(start_ms)
     end_utc = ts_ms_to_iso(end_ms)
     created_ms = attrs.get("createdDate")
     created_utc = ts_ms_to_iso(created_ms)
-    last_seen_utc = datetime.now(timezone.utc).isoformat(timespec="seconds")
 
-    classification_json = json.dumps(attrs.get("classification") or [])
-    genres_json = json.dumps(attrs.get("genres") or [])
-    content_segments_json = json.dumps(attrs.get("contentSegments") or [])
     is_free = int(bool(attrs.get("isFree")))
     is_premium = int(bool(attrs.get("isPremium")))
 
-    cur.execute(
-        """INSERT INTO events (
-            id, pvid, slug, title, title_brief, synopsis, synopsis_brief,
-            channel_name, channel_provider_id,
-            airing_type, classification_json, genres_json, content_segments_json,
-            is_free, is_premium, runtime_secs,
-            start_ms, end_ms, start_utc, end_utc,
-            created_ms, created_utc, last_seen_utc, raw_attributes_json
-        ) VALUES (
-            :id, :pvid, :slug, :title, :title_brief, :synopsis, :synopsis_brief,
-            :channel_name, :channel_provider_id,
-            :airing_type, :classification_json, :genres_json, :content_segments_json,
-            :is_free, :is_premium, :runtime_secs,
-            :start_ms, :end_ms, :start_utc, :end_utc,
-            :created_ms, :created_utc, :last_seen_utc, :raw_attributes_json
-        )
-        ON CONFLICT(id) DO UPDATE SET
-            pvid=excluded.pvid, slug=excluded.slug, title=excluded.title,
-            title_brief=excluded.title_brief, synopsis=excluded.synopsis, synopsis_brief=excluded.synopsis_brief,
-            channel_name=excluded.channel_name, channel_provider_id=excluded.channel_provider_id,
-            airing_type=excluded.airing_type, classification_json=excluded.classification_json,
-            genres_json=excluded.genres_json, content_segments_json=excluded.content_segments_json,
-            is_free=excluded.is_free, is_premium=excluded.is_premium, runtime_secs=excluded.runtime_secs,
-            start_ms=excluded.start_ms, end_ms=excluded.end_ms, start_utc=excluded.start_utc, end_utc=excluded.end_utc,
-            last_seen_utc=excluded.last_seen_utc, raw_attributes_json=excluded.raw_attributes_json
-        """,
-        {
-            "id": node_id, "pvid": pvid, "slug": slug, "title": title, "title_brief": title_brief,
-            "synopsis": synopsis, "synopsis_brief": synopsis_brief,
-            "channel_name": channel_name, "channel_provider_id": channel_provider_id,
-            "airing_type": attrs.get("airingType"),
-            "classification_json": classification_json, "genres_json": genres_json,
-            "content_segments_json": content_segments_json,
-            "is_free": is_free, "is_premium": is_premium, "runtime_secs": runtime_secs,
-            "start_ms": start_ms, "end_ms": end_ms, "start_utc": start_utc, "end_utc": end_utc,
-            "created_ms": created_ms, "created_utc": created_utc,
-            "last_seen_utc": last_seen_utc, "raw_attributes_json": json.dumps(attrs),
-        },
+    event = (
+        node_id, pvid, slug, title, title_brief, synopsis, synopsis_brief,
+        channel_name, channel_provider_id,
+        intern_str(attrs.get("airingType")),
+        is_free, is_premium, runtime_secs,
+        start_ms, end_ms, start_utc, end_utc,
+        created_ms, created_utc, json_dumps(attrs),
     )
 
+    # Deduplicated, first-seen order; the same (type, url) often repeats within an item
+    image_keys: Dict[Tuple[str, str, str], None] = {}
     for img in (attrs.get("images") or []):
         url = img.get("url") or img.get("template")
         if node_id and img.get("type") and url:
-            cur.execute("INSERT OR IGNORE INTO event_images VALUES (?, ?, ?)", (node_id, img["type"], url))
-    conn.commit()
+            image_keys[(node_id, intern_str(img["type"]), url)] = None
+    images = list(image_keys)
+    # Hash of everything stored for the item; equal hash means nothing to rewrite
+    content_hash = hashlib.blake2b(repr((event, images)).encode(), digest_size=8).digest()
+    return event + (content_hash,), images
+
+# What binding one bad value can raise; ints beyond 64 bits give OverflowError
+BIND_ERRORS = (sqlite3.Error, OverflowError, ValueError)
+
+def upsert_events(cur: sqlite3.Cursor, rows: List[Tuple]) -> set:
+    """Upsert rows in one executemany; if the batch fails, redo it row by row
+    so only the rows SQLite rejects are reported and skipped. Returns their ids."""
+    try:
+        cur.executemany(UPSERT_EVENT_SQL, rows)
+        return set()
+    except BIND_ERRORS:
+        pass
+    failed = set()
+    for row in rows:
+        try:
+            cur.execute(UPSERT_EVENT_SQL, row)
+        except BIND_ERRORS as e:
+            print(f"Error: {row[0]}: {e}")
+            failed.add(row[0])
+    return failed
+
+def make_session() -> requests.Session:
+    """Keep-alive session so several slugs share one TLS connection"""
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=10, max_retries=Retry(total=3, backoff_factor=0.3))
+    session.mount("https://", adapter)
+    return session
 
-def main():
+def fetch_items(session: requests.Session, slug: str) -> List[Dict[str, Any]]:
+    """relationships.items.data for slug; the body and the rest of the tree are freed on return"""
+    with session.get(
+        ATOM_BASE,
+        params={"slug": slug, "represent": "(items(items))"},
+        headers={"Referer": f"https://www.peacocktv.com{slug}"},
+        timeout=30,
+        stream=True,
+    ) as resp:
+        resp.raise_for_status()
+        # One read of the decoded body; resp.content would join a chunk list into a second copy
+        resp.raw.decode_content = True
+        data = json_loads(resp.raw.read())
+    rel = data.get("relationships") or {}
+    return (rel.get("items") or {}).get("data") or []
+
+def main(argv: Optional[List[str]] = None):
     script_dir = Path(__file__).resolve().parent
     default_db = str(script_dir.parent / 'data' / 'peacock_events.db') if script_dir.name == 'bin' else "peacock_events.db"
     
@@ -140,33 +236,59 @@ def main():
     
     ap = argparse.ArgumentParser()
     ap.add_argument("--db", default=env_db or default_db)
-    ap.add_argument("--slug", default=env_slug or "/sports/live-and-upcoming")
-    args = ap.parse_args()
+    ap.add_argument("--slug", nargs="+", default=[env_slug or "/sports/live-and-upcoming"])
+    args = ap.parse_args(argv)
     
     Path(args.db).parent.mkdir(parents=True, exist_ok=True)
     conn = sqlite3.connect(args.db)
     ensure_schema(conn)
     
-    headers = dict(HEADERS)
-    headers["Referer"] = f"https://www.peacocktv.com{args.slug}"
-    print(f"Fetching {args.slug}...")
-    resp = requests.get(ATOM_BASE, params={"slug": args.slug, "represent": "(items(items))"}, headers=headers, timeout=30)
-    resp.raise_for_status()
-    data = resp.json()
+    # Slugs are fetched concurrently over the session's pool; SQLite stays on this thread
+    session = make_session()
+    print(f"Fetching {', '.join(args.slug)}...")
+    with ThreadPoolExecutor(max_workers=min(len(args.slug), 10)) as ex:
+        results = list(ex.map(lambda slug: fetch_items(session, slug), args.slug))
+    session.close()
     
-    rel = data.get("relationships") or {}
-    items = (rel.get("items") or {}).get("data") or []
-    print(f"Found {len(items)} items")
+    last_seen_utc = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    cur = conn.cursor()
+    stored_hashes = dict(cur.execute("SELECT id, content_hash FROM events"))
+    rows, images, seen_ids = [], [], []
+    for slug, slug_items in zip(args.slug, results):
+        print(f"Found {len(slug_items)} items in {slug}")
+        for item in slug_items:
+            try:
+                event, event_images = build_event_params(item)
+            except Exception as e:
+                print(f"Error: {e}")
+                continue
+            seen_ids.append(event[0])
+            if stored_hashes.get(event[0]) == event[-1]:
+                continue
+            rows.append(event)
+            images.extend(event_images)
+        # Rows hold everything kept from the parsed items; release them slug by slug
+        slug_items.clear()
     
-    count = 0
-    for item in items:
-        try:
-            upsert_event(conn, item)
-            count += 1
-        except Exception as e:
-            print(f"Error: {e}")
+    # One transaction for the whole response instead of a commit per item;
+    # every seen event, changed or not, is then stamped in a few IN (...) sweeps
+    with conn:
+        failed = upsert_events(cur, rows)
+        if failed:
+            images = [img for img in images if img[0] not in failed]
+            seen_ids = [event_id for event_id in seen_ids if event_id not in failed]
+        cur.executemany("INSERT OR IGNORE INTO event_images VALUES (?, ?, ?)", images)
+        for i in range(0, len(seen_ids), LAST_SEEN_CHUNK):
+            chunk = seen_ids[i:i + LAST_SEEN_CHUNK]
+            cur.execute(
+                f"UPDATE events SET last_seen_utc = ? WHERE id IN ({','.join('?' * len(chunk))})",
+                (last_seen_utc, *chunk),
+            )
     
-    print(f"Upserted {count} events into {args.db}")
+    upserted = len(rows) - len(failed)
+    print(f"Upserted {upserted} events ({len(seen_ids) - upserted} unchanged) into {args.db}")
+    if failed:
+        print(f"Skipped {len(failed)} events SQLite could not store")
     return 0
 
 if __name__ == "__main__":
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 """peacock_refresh_all.py - Complete refresh: ingest → build → export"""
-import os, argparse, subprocess, sys
+import os, argparse, sys, traceback
 from pathlib import Path
+from typing import Callable, List
 
 def find_script_dir() -> Path:
     script_path = Path(__file__).resolve()
@@ -11,19 +12,27 @@ def find_repo_root() -> Path:
     script_dir = find_script_dir()
     return script_dir.parent if script_dir.name == 'bin' else script_dir
 
-def run_command(cmd: list, description: str) -> int:
+def run_step(step_main: Callable[[List[str]], int], argv: List[str], description: str) -> int:
+    """Run a pipeline script's main() in this process (no interpreter start-up per step)"""
     print(f"\n{'='*80}\n{description}\n{'='*80}")
-    print(f"Running: {' '.join(cmd)}\n")
+    print(f"Running: {step_main.__module__} {' '.join(argv)}\n")
     try:
-        proc = subprocess.run(cmd, check=False)
-        return proc.returncode
+        return step_main(argv) or 0
     except KeyboardInterrupt:
         print("\nInterrupted by user")
         return 1
+    except SystemExit as e:
+        # SystemExit(None) is a normal exit; a message string means failure
+        return 0 if e.code is None else (e.code if isinstance(e.code, int) else 1)
+    except Exception:
+        traceback.print_exc()
+        return 1
 
 def main():
     repo_root = find_repo_root()
     script_dir = find_script_dir()
+    sys.path.insert(0, str(script_dir))
+    import peacock_ingest_atom, peacock_build_lanes, peacock_export_from_db
 
     default_db = repo_root / "data" / "peacock_events.db"
     default_xml = repo_root / "out" / "peacock_lanes.xml"
@@ -38,7 +47,7 @@ def main():
     
     ap = argparse.ArgumentParser()
     ap.add_argument("--db", default=str(env_db or default_db))
-    ap.add_argument("--slug", default=env_slug or "/sports/live-and-upcoming")
+    ap.add_argument("--slug", nargs="+", default=[env_slug or "/sports/live-and-upcoming"])
     ap.add_argument("--lanes", type=int, default=int(env_lanes) if env_lanes else 10)
     ap.add_argument("--days-ahead", type=int, default=int(env_days) if env_days else 7)
     ap.add_argument("--xml", default=str(env_xml or default_xml))
@@ -57,18 +66,18 @@ def main():
     print(f"Output: {args.xml}, {args.m3u}")
     
     if not args.skip_ingest:
-        if run_command(
-            [sys.executable, str(script_dir / "peacock_ingest_atom.py"), "--db", args.db, "--slug", args.slug],
+        if run_step(
+            peacock_ingest_atom.main,
+            ["--db", args.db, "--slug", *args.slug],
             "STEP 1: Ingest from Peacock API",
         ) != 0:
             return 1
     else:
         print("\n⚠ Skipping API ingest")
     
-    if run_command(
+    if run_step(
+        peacock_build_lanes.main,
         [
-            sys.executable,
-            str(script_dir / "peacock_build_lanes.py"),
             "--db",
             args.db,
             "--lanes",
@@ -80,10 +89,9 @@ def main():
     ) != 0:
         return 1
     
-    if run_command(
+    if run_step(
+        peacock_export_from_db.main,
         [
-            sys.executable,
-            str(script_dir / "peacock_export_from_db.py"),
             "--db",
             args.db,
             "--xml",
@@ -3,13 +3,18 @@
 peacock_server.py - Web server with scheduled refreshes and deeplink API
 """
 
-import os, logging, subprocess, sys, json, sqlite3
+import os, logging, io, functools, json, re, sqlite3, time, traceback, urllib.parse
+from collections import deque
+from contextlib import contextmanager, redirect_stderr, redirect_stdout
 from datetime import datetime, timezone
 from pathlib import Path
-from threading import Lock
-from flask import Flask, send_file, jsonify, render_template_string, redirect
+from queue import Empty, SimpleQueue
+from threading import Lock, Thread
+from typing import Callable, List, Optional
+from flask import Flask, Response, request, send_file, jsonify, redirect
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+import peacock_ingest_atom, peacock_build_lanes, peacock_export_hybrid
 
 # Configuration
 PORT = int(os.getenv("PEACOCK_PORT", "6655"))
@@ -23,8 +28,20 @@ REFRESH_CRON = os.getenv("PEACOCK_REFRESH_CRON", "15 3 * * *")
 LANES = int(os.getenv("PEACOCK_LANES", "10"))
 DAYS_AHEAD = int(os.getenv("PEACOCK_DAYS_AHEAD", "7"))
 SLUG = os.getenv("PEACOCK_SLUG", "/sports/live-and-upcoming")
+# Set when a front proxy (nginx X-Accel / Apache mod_xsendfile) serves the files
+X_SENDFILE = os.getenv("PEACOCK_X_SENDFILE", "").lower() in ("1", "true", "yes")
+DEEPLINK_HEAD = "https://www.peacocktv.com/deeplink?deeplinkData=" + urllib.parse.quote('{"pvid":', safe="")
+DEEPLINK_TAIL = urllib.parse.quote(',"type":"PROGRAMME","action":"PLAY"}', safe="")
+# pvids made only of these need neither JSON escaping nor percent-encoding
+PVID_SAFE_RE = re.compile(r"[A-Za-z0-9_.~-]+")
+# Lane lookups are reused within this many seconds (and dropped after a refresh)
+DEEPLINK_CACHE_SECONDS = 30
+# Per-step time budget; an overrunning step fails the refresh and blocks the next one
+# until it finishes (it cannot be interrupted)
+STEP_TIMEOUT_SECONDS = 300
 
-# Server URL construction
+# Server URL construction; the environment is fixed for the process lifetime
+@functools.lru_cache(maxsize=1)
 def get_server_url():
     """Build server URL from host and port"""
     # Try new style first (separate host and port)
@@ -42,6 +59,17 @@ def get_server_url():
     # Default
     return f"http://localhost:{PORT}"
 
+@functools.lru_cache(maxsize=1)
+def server_config():
+    """Static config shown on the dashboard and in /api/status (treat as read-only)"""
+    return {
+        "server_url": get_server_url(),
+        "lanes": LANES,
+        "days_ahead": DAYS_AHEAD,
+        "refresh_cron": REFRESH_CRON,
+        "port": PORT
+    }
+
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
@@ -49,12 +77,33 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def build_refresh_trigger() -> Optional[CronTrigger]:
+    """Parse REFRESH_CRON; logs and returns None if it is not a valid 5-field cron"""
+    parts = REFRESH_CRON.split()
+    if len(parts) != 5:
+        logger.warning(f"Invalid cron expression: {REFRESH_CRON}")
+        return None
+    try:
+        return CronTrigger(
+            minute=parts[0], hour=parts[1], day=parts[2],
+            month=parts[3], day_of_week=parts[4], timezone="UTC"
+        )
+    except ValueError as e:
+        logger.warning(f"Invalid cron expression: {REFRESH_CRON} ({e})")
+        return None
+
+# Parsed at import so a bad schedule is reported before the server starts listening
+REFRESH_TRIGGER = build_refresh_trigger()
+
 # Flask app
 app = Flask(__name__)
 app.config['JSON_SORT_KEYS'] = False
+app.config['USE_X_SENDFILE'] = X_SENDFILE
 
 # State tracking
 refresh_lock = Lock()
+# Pipeline step thread that outlived STEP_TIMEOUT_SECONDS, if any
+overrun_step: Optional[Thread] = None
 last_refresh = {
     "status": "never",
     "start_time": None,
@@ -66,73 +115,164 @@ last_refresh = {
     "direct_channels_count": 0,
 }
 
-def get_script_dir():
-    return Path(__file__).resolve().parent
+def init_db_pragmas():
+    """Switch the DB to WAL once so API reads don't block on refresh writers"""
+    # journal_mode is persistent in the file; synchronous and the rest are
+    # per-connection, so the step scripts set them on their own writers (see connect_ro)
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.close()
+
+def connect_ro() -> sqlite3.Connection:
+    """Read-only connection for API lookups and stats"""
+    conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro&cache=private", uri=True,
+                           check_same_thread=False, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA query_only=1")
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("PRAGMA cache_size=-20000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+# Idle read-only connections, shared by the per-request worker threads
+ro_pool = SimpleQueue()
+
+@contextmanager
+def get_ro_conn():
+    """Borrow a pooled read-only connection; it goes back to the pool, not closed"""
+    try:
+        conn = ro_pool.get_nowait()
+    except Empty:
+        conn = connect_ro()
+    try:
+        yield conn
+    finally:
+        ro_pool.put(conn)
+
+@functools.lru_cache(maxsize=4096)
+def build_deeplink(pvid: str) -> str:
+    # Only the pvid varies, so the constant JSON/quoted parts are precomputed
+    if PVID_SAFE_RE.fullmatch(pvid):
+        return f"{DEEPLINK_HEAD}%22{pvid}%22{DEEPLINK_TAIL}"
+    return f"{DEEPLINK_HEAD}{urllib.parse.quote(json.dumps(pvid), safe='')}{DEEPLINK_TAIL}"
+
+# Current event first (latest start), else the next upcoming one; each branch is a
+# bounded range probe and the whole lookup is one statement. Kept as one constant
+# so every pooled connection's statement cache hits on the same compiled query.
+LANE_DEEPLINK_SQL = """
+    SELECT * FROM (
+        SELECT 0 AS priority, e.pvid
+        FROM lane_events le
+        JOIN events e ON le.event_id = e.id
+        WHERE le.lane_id = :lane
+          AND le.is_placeholder = 0
+          AND le.start_utc <= :now
+          AND le.end_utc > :now
+          AND e.pvid IS NOT NULL
+        ORDER BY le.start_utc DESC
+        LIMIT 1
+    )
+    UNION ALL
+    SELECT * FROM (
+        SELECT 1 AS priority, e.pvid
+        FROM lane_events le
+        JOIN events e ON le.event_id = e.id
+        WHERE le.lane_id = :lane
+          AND le.is_placeholder = 0
+          AND le.start_utc > :now
+          AND e.pvid IS NOT NULL
+        ORDER BY le.start_utc ASC
+        LIMIT 1
+    )
+    ORDER BY priority
+    LIMIT 1
+"""
+
+now_iso_cache = {"t": -1.0, "iso": ""}
+
+def now_iso() -> str:
+    """UTC now as ISO text, shared for up to a second so a burst of lane polls reuses it"""
+    t = time.monotonic()
+    if t - now_iso_cache["t"] >= 1.0:
+        now_iso_cache["iso"] = datetime.now(timezone.utc).isoformat()
+        now_iso_cache["t"] = t
+    return now_iso_cache["iso"]
+
+@functools.lru_cache(maxsize=256)
+def lookup_lane_deeplink(lane_id: int, bucket: int) -> Optional[str]:
+    """Deeplink for a lane's current (else next) event; bucket only keys the cache"""
+    now = now_iso()
+    
+    with get_ro_conn() as conn:
+        row = conn.execute(LANE_DEEPLINK_SQL, {"lane": lane_id, "now": now}).fetchone()
+    
+    if not row or not row["pvid"]:
+        return None
+    
+    return build_deeplink(row["pvid"])
 
 def get_current_lane_deeplink(lane_id: int) -> str:
     """Get the deeplink URL for the currently playing event in a lane"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-        
-        now = datetime.now(timezone.utc).isoformat()
-        
-        # Find current event in this lane
-        cur.execute("""
-            SELECT e.pvid
-            FROM lane_events le
-            JOIN events e ON le.event_id = e.id
-            WHERE le.lane_id = ?
-              AND le.is_placeholder = 0
-              AND le.start_utc <= ?
-              AND le.end_utc > ?
-              AND e.pvid IS NOT NULL
-            ORDER BY le.start_utc DESC
-            LIMIT 1
-        """, (lane_id, now, now))
-        
-        row = cur.fetchone()
-        conn.close()
-        
-        if not row or not row["pvid"]:
-            # No current event, find next upcoming
-            conn = sqlite3.connect(DB_PATH)
-            conn.row_factory = sqlite3.Row
-            cur = conn.cursor()
-            
-            cur.execute("""
-                SELECT e.pvid
-                FROM lane_events le
-                JOIN events e ON le.event_id = e.id
-                WHERE le.lane_id = ?
-                  AND le.is_placeholder = 0
-                  AND le.start_utc > ?
-                  AND e.pvid IS NOT NULL
-                ORDER BY le.start_utc ASC
-                LIMIT 1
-            """, (lane_id, now))
-            
-            row = cur.fetchone()
-            conn.close()
-            
-            if not row or not row["pvid"]:
-                return None
-        
-        pvid = row["pvid"]
-        
-        # Build deeplink
-        import urllib.parse
-        deeplink_payload = {"pvid": pvid, "type": "PROGRAMME", "action": "PLAY"}
-        deeplink_json = json.dumps(deeplink_payload, separators=(",", ":"))
-        deeplink_url = f"https://www.peacocktv.com/deeplink?deeplinkData={urllib.parse.quote(deeplink_json, safe='')}"
-        
-        return deeplink_url
-        
+        return lookup_lane_deeplink(lane_id, int(time.time() // DEEPLINK_CACHE_SECONDS))
     except Exception as e:
         logger.error(f"Error getting deeplink for lane {lane_id}: {e}")
         return None
 
+class StepLog(io.TextIOBase):
+    """stdout sink for a pipeline step: logs lines as they are printed, keeps a short tail"""
+    def __init__(self, name: str, keep: int = 20):
+        self.name = name
+        self.partial = ""
+        self.tail = deque(maxlen=keep)
+        self.lock = Lock()
+    
+    def write(self, s: str) -> int:
+        # Export builders print from worker threads
+        with self.lock:
+            *lines, self.partial = (self.partial + s).split("\n")
+            for line in lines:
+                if line:
+                    logger.info(f"[{self.name}] {line}")
+                    self.tail.append(line)
+        return len(s)
+    
+    def getvalue(self) -> str:
+        return "\n".join([*self.tail, self.partial])
+
+def run_step(step_main: Callable[[List[str]], int], argv: List[str], name: str):
+    """Run a pipeline script's main() on a worker thread; raise if it fails or overruns"""
+    global overrun_step
+    out = StepLog(name)
+    result = {}
+    
+    def target():
+        try:
+            result["rc"] = step_main(argv)
+        except SystemExit as e:
+            result["rc"] = 0 if e.code is None else (e.code if isinstance(e.code, int) else 1)
+        except BaseException:
+            result["error"] = traceback.format_exc()
+    
+    worker = Thread(target=target, name=f"step-{name}", daemon=True)
+    # redirect_stdout/stderr swap the streams for the whole process, not just this
+    # thread: a print() from a request thread during a refresh also lands in this
+    # step's log and error tail. The server itself only uses logging (its handler
+    # keeps the original stderr), so only the step scripts print here.
+    with redirect_stdout(out), redirect_stderr(out):
+        worker.start()
+        worker.join(STEP_TIMEOUT_SECONDS)
+    if worker.is_alive():
+        # A thread cannot be killed: the step keeps running in the background and
+        # whatever it has already written stays written
+        overrun_step = worker
+        raise Exception(f"{name} still running after the {STEP_TIMEOUT_SECONDS}s step limit; "
+                        f"remaining steps skipped\n{out.getvalue()}")
+    if "error" in result:
+        raise Exception(f"{name} failed:\n{result['error']}{out.getvalue()}")
+    if result["rc"]:
+        raise Exception(f"{name} failed (exit {result['rc']}): {out.getvalue()}")
+
 def run_refresh():
     """Run the complete refresh process"""
     global last_refresh
@@ -140,6 +280,10 @@ def run_refresh():
     if not refresh_lock.acquire(blocking=False):
         logger.warning("Refresh already in progress, skipping")
         return
+    if overrun_step is not None and overrun_step.is_alive():
+        refresh_lock.release()
+        logger.warning(f"{overrun_step.name} from an earlier refresh is still running, skipping")
+        return
     
     try:
         start_time = datetime.now(timezone.utc)
@@ -149,67 +293,43 @@ def run_refresh():
         
         logger.info("Starting scheduled refresh...")
         
-        script_dir = get_script_dir()
         server_url = get_server_url()
         
         # Step 1: Ingest
         logger.info("Step 1: Ingesting from Peacock API...")
-        result = subprocess.run(
-            [sys.executable, str(script_dir / "peacock_ingest_atom.py"),
-             "--db", DB_PATH, "--slug", SLUG],
-            capture_output=True, text=True, timeout=300
-        )
-        
-        if result.returncode != 0:
-            raise Exception(f"Ingest failed: {result.stderr}")
-        
+        run_step(peacock_ingest_atom.main, ["--db", DB_PATH, "--slug", SLUG], "Ingest")
         logger.info("Ingest complete")
         
         # Step 2: Build lanes
         logger.info("Step 2: Building lanes...")
-        result = subprocess.run(
-            [sys.executable, str(script_dir / "peacock_build_lanes.py"),
-             "--db", DB_PATH, "--lanes", str(LANES), "--days-ahead", str(DAYS_AHEAD)],
-            capture_output=True, text=True, timeout=300
-        )
-        
-        if result.returncode != 0:
-            raise Exception(f"Build lanes failed: {result.stderr}")
-        
+        run_step(peacock_build_lanes.main,
+                 ["--db", DB_PATH, "--lanes", str(LANES), "--days-ahead", str(DAYS_AHEAD)],
+                 "Build lanes")
         logger.info("Build lanes complete")
         
         # Step 3: Export (hybrid mode)
         logger.info("Step 3: Exporting XMLTV/M3U (both formats)...")
-        result = subprocess.run(
-            [sys.executable, str(script_dir / "peacock_export_hybrid.py"),
-             "--db", DB_PATH,
-             "--lanes-xml", LANES_XML_PATH, "--lanes-m3u", LANES_M3U_PATH,
-             "--chrome-m3u", CHROME_M3U_PATH,
-             "--direct-xml", DIRECT_XML_PATH, "--direct-m3u", DIRECT_M3U_PATH,
-             "--server-url", server_url],
-            capture_output=True, text=True, timeout=300
-        )
-        
-        if result.returncode != 0:
-            raise Exception(f"Export failed: {result.stderr}")
-        
+        run_step(peacock_export_hybrid.main,
+                 ["--db", DB_PATH,
+                  "--lanes-xml", LANES_XML_PATH, "--lanes-m3u", LANES_M3U_PATH,
+                  "--chrome-m3u", CHROME_M3U_PATH,
+                  "--direct-xml", DIRECT_XML_PATH, "--direct-m3u", DIRECT_M3U_PATH,
+                  "--server-url", server_url],
+                 "Export")
         logger.info("Export complete")
+        lookup_lane_deeplink.cache_clear()
+        files_status_cache["t"] = 0.0
         
         # Get stats
         try:
-            conn = sqlite3.connect(DB_PATH)
-            cur = conn.cursor()
-            
-            cur.execute("SELECT COUNT(*) FROM events WHERE pvid IS NOT NULL")
-            events_count = cur.fetchone()[0]
-            
-            cur.execute("SELECT COUNT(*) FROM lanes")
-            lanes_count = cur.fetchone()[0]
-            
-            cur.execute("SELECT COUNT(DISTINCT le.event_id) FROM lane_events le WHERE le.is_placeholder = 0")
-            direct_count = cur.fetchone()[0]
-            
-            conn.close()
+            # One statement: one snapshot of all three tables, one round-trip
+            with get_ro_conn() as conn:
+                events_count, lanes_count, direct_count = conn.execute("""
+                    SELECT
+                      (SELECT COUNT(*) FROM events WHERE pvid IS NOT NULL),
+                      (SELECT COUNT(*) FROM lanes),
+                      (SELECT COUNT(DISTINCT le.event_id) FROM lane_events le WHERE le.is_placeholder = 0)
+                """).fetchone()
             
             last_refresh["events_count"] = events_count
             last_refresh["lanes_count"] = lanes_count
@@ -227,7 +347,7 @@ def run_refresh():
         logger.info(f"Refresh completed successfully in {duration:.1f}s")
         
     except Exception as e:
-        logger.error(f"Refresh failed: {e}")
+        logger.exception("Refresh failed")
         last_refresh["status"] = "failed"
         last_refresh["error"] = str(e)
         last_refresh["end_time"] = datetime.now(timezone.utc).isoformat()
@@ -301,6 +421,7 @@ DASHBOARD_HTML = """
         }
         .info-label { color: #94a3b8; }
         .info-value { color: #f1f5f9; font-weight: 500; }
+        [hidden] { display: none !important; }
     </style>
 </head>
 <body>
@@ -310,30 +431,24 @@ DASHBOARD_HTML = """
         
         <div class="card">
             <h2>Status</h2>
-            <div>Last Refresh: <span class="status-badge status-{{ status }}">{{ status|upper }}</span></div>
+            <div>Last Refresh: <span class="status-badge status-never" id="status">NEVER</span></div>
             
-            {% if last_refresh.start_time %}
-            <div class="info-grid">
+            <div class="info-grid" id="timing" hidden>
                 <div class="info-row">
                     <span class="info-label">Started:</span>
-                    <span class="info-value">{{ last_refresh.start_time }}</span>
+                    <span class="info-value" id="start-time"></span>
                 </div>
-                {% if last_refresh.end_time %}
-                <div class="info-row">
+                <div class="info-row" id="end-row" hidden>
                     <span class="info-label">Completed:</span>
-                    <span class="info-value">{{ last_refresh.end_time }}</span>
+                    <span class="info-value" id="end-time"></span>
                 </div>
-                <div class="info-row">
+                <div class="info-row" id="duration-row" hidden>
                     <span class="info-label">Duration:</span>
-                    <span class="info-value">{{ last_refresh.duration_seconds }}s</span>
+                    <span class="info-value" id="duration"></span>
                 </div>
-                {% endif %}
             </div>
-            {% endif %}
             
-            {% if last_refresh.error %}
-            <div class="error">{{ last_refresh.error }}</div>
-            {% endif %}
+            <div class="error" id="error" hidden></div>
             
             <div style="margin-top: 1.5rem;">
                 <button onclick="refresh()" id="refreshBtn">🔄 Refresh Now</button>
@@ -345,19 +460,19 @@ DASHBOARD_HTML = """
             <div class="stat-grid">
                 <div class="stat">
                     <div class="stat-label">Total Events</div>
-                    <div class="stat-value">{{ last_refresh.events_count or 0 }}</div>
+                    <div class="stat-value" id="events-count">0</div>
                 </div>
                 <div class="stat">
                     <div class="stat-label">Lanes</div>
-                    <div class="stat-value">{{ last_refresh.lanes_count or 0 }}</div>
+                    <div class="stat-value" id="lanes-count">0</div>
                 </div>
                 <div class="stat">
                     <div class="stat-label">Direct Channels</div>
-                    <div class="stat-value">{{ last_refresh.direct_channels_count or 0 }}</div>
+                    <div class="stat-value" id="direct-count">0</div>
                 </div>
                 <div class="stat">
                     <div class="stat-label">Next Refresh</div>
-                    <div class="stat-value" style="font-size: 1rem;">{{ next_run or 'Not scheduled' }}</div>
+                    <div class="stat-value" style="font-size: 1rem;" id="next-run">Not scheduled</div>
                 </div>
             </div>
         </div>
@@ -426,6 +541,36 @@ DASHBOARD_HTML = """
     </div>
     
     <script>
+        // The page itself is static; live state comes from /api/status
+        function setText(id, value) {
+            document.getElementById(id).textContent = value;
+        }
+        
+        function render(data) {
+            const r = data.last_refresh;
+            const badge = document.getElementById('status');
+            badge.className = 'status-badge status-' + r.status;
+            badge.textContent = r.status.toUpperCase();
+            
+            document.getElementById('timing').hidden = !r.start_time;
+            setText('start-time', r.start_time || '');
+            document.getElementById('end-row').hidden = !r.end_time;
+            document.getElementById('duration-row').hidden = !r.end_time;
+            setText('end-time', r.end_time || '');
+            setText('duration', r.duration_seconds + 's');
+            
+            const error = document.getElementById('error');
+            error.hidden = !r.error;
+            error.textContent = r.error || '';
+            
+            setText('events-count', r.events_count || 0);
+            setText('lanes-count', r.lanes_count || 0);
+            setText('direct-count', r.direct_channels_count || 0);
+            setText('next-run', data.next_run || 'Not scheduled');
+        }
+        
+        fetch('/api/status').then(r => r.json()).then(render);
+        
         function refresh() {
             const btn = document.getElementById('refreshBtn');
             btn.disabled = true;
@@ -446,65 +591,63 @@ DASHBOARD_HTML = """
 </body>
 </html>
 """
+# Only the static config is templated, so the page is rendered once (with Flask's
+# autoescaping environment) and the script fills in the live state
+DASHBOARD_PAGE = app.jinja_env.from_string(DASHBOARD_HTML).render(config=server_config())
 
 # Routes
+def get_next_run():
+    """Next scheduled refresh as display text, or None"""
+    if scheduler:
+        job = scheduler.get_job('daily_refresh')
+        if job and job.next_run_time:
+            return job.next_run_time.strftime('%Y-%m-%d %H:%M:%S %Z')
+    return None
+
 @app.route('/')
 def dashboard():
-    next_run = None
-    if scheduler:
-        jobs = scheduler.get_jobs()
-        if jobs:
-            next_run_dt = jobs[0].next_run_time
-            if next_run_dt:
-                next_run = next_run_dt.strftime('%Y-%m-%d %H:%M:%S %Z')
-    
-    return render_template_string(
-        DASHBOARD_HTML,
-        status=last_refresh["status"],
-        last_refresh=last_refresh,
-        next_run=next_run,
-        config={
-            "server_url": get_server_url(),
-            "lanes": LANES,
-            "days_ahead": DAYS_AHEAD,
-            "refresh_cron": REFRESH_CRON,
-            "port": PORT
-        }
-    )
+    return Response(DASHBOARD_PAGE, mimetype='text/html')
+
+def serve_export(path: str, mimetype: str, download_name: str, label: str):
+    """Serve an exported file; unchanged files get a 304 from a single stat()"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return jsonify({"error": f"{label} not found. Run refresh first."}), 404
+    # Exports are replaced atomically, so mtime+size identifies the content
+    etag = f"{st.st_mtime_ns:x}-{st.st_size:x}"
+    if request.if_none_match.contains(etag):
+        rv = Response(status=304)
+        rv.set_etag(etag)
+        return rv
+    # conditional=True also turns Range requests into offset reads of the file
+    # (or sendfile via the WSGI server's file_wrapper) instead of full copies
+    return send_file(path, mimetype=mimetype, as_attachment=False, download_name=download_name,
+                     conditional=True, etag=etag, last_modified=st.st_mtime)
 
 # Lane-based files (for ADBTuner)
 @app.route('/lanes/xmltv')
 @app.route('/xmltv')
 def serve_lanes_xmltv():
-    if not Path(LANES_XML_PATH).exists():
-        return jsonify({"error": "Lanes XMLTV not found. Run refresh first."}), 404
-    return send_file(LANES_XML_PATH, mimetype='application/xml', as_attachment=False, download_name='peacock_lanes.xml')
+    return serve_export(LANES_XML_PATH, 'application/xml', 'peacock_lanes.xml', "Lanes XMLTV")
 
 @app.route('/lanes/m3u')
 @app.route('/m3u')
 def serve_lanes_m3u():
-    if not Path(LANES_M3U_PATH).exists():
-        return jsonify({"error": "Lanes M3U not found. Run refresh first."}), 404
-    return send_file(LANES_M3U_PATH, mimetype='audio/x-mpegurl', as_attachment=False, download_name='peacock_lanes.m3u')
+    return serve_export(LANES_M3U_PATH, 'audio/x-mpegurl', 'peacock_lanes.m3u', "Lanes M3U")
 
 @app.route('/chrome/m3u')
 def serve_chrome_m3u():
-    if not Path(CHROME_M3U_PATH).exists():
-        return jsonify({"error": "Chrome M3U not found. Run refresh first."}), 404
-    return send_file(CHROME_M3U_PATH, mimetype='audio/x-mpegurl', as_attachment=False, download_name='peacock_lanes_chrome.m3u')
+    return serve_export(CHROME_M3U_PATH, 'audio/x-mpegurl', 'peacock_lanes_chrome.m3u', "Chrome M3U")
 
 # Direct deeplink files
 @app.route('/direct/xmltv')
 def serve_direct_xmltv():
-    if not Path(DIRECT_XML_PATH).exists():
-        return jsonify({"error": "Direct XMLTV not found. Run refresh first."}), 404
-    return send_file(DIRECT_XML_PATH, mimetype='application/xml', as_attachment=False, download_name='peacock_direct.xml')
+    return serve_export(DIRECT_XML_PATH, 'application/xml', 'peacock_direct.xml', "Direct XMLTV")
 
 @app.route('/direct/m3u')
 def serve_direct_m3u():
-    if not Path(DIRECT_M3U_PATH).exists():
-        return jsonify({"error": "Direct M3U not found. Run refresh first."}), 404
-    return send_file(DIRECT_M3U_PATH, mimetype='audio/x-mpegurl', as_attachment=False, download_name='peacock_direct.m3u')
+    return serve_export(DIRECT_M3U_PATH, 'audio/x-mpegurl', 'peacock_direct.m3u', "Direct M3U")
 
 # API
 @app.route('/api/lane/<int:lane_id>/deeplink')
@@ -527,7 +670,6 @@ def api_lane_deeplink(lane_id):
         return jsonify({"error": f"No current or upcoming event for lane {lane_id}"}), 404
     
     # Check format
-    from flask import request
     fmt = request.args.get('format', '').lower()
     
     # Legacy redirect parameter support
@@ -549,19 +691,14 @@ def api_lane_deeplink(lane_id):
         # Redirect mode (default for ADBTuner)
         return redirect(deeplink, code=302)
 
-@app.route('/api/status')
-def api_status():
-    return jsonify({
-        "status": "ok",
-        "last_refresh": last_refresh,
-        "config": {
-            "server_url": get_server_url(),
-            "lanes": LANES,
-            "days_ahead": DAYS_AHEAD,
-            "refresh_cron": REFRESH_CRON,
-            "port": PORT
-        },
-        "files": {
+FILES_STATUS_TTL = 5.0
+files_status_cache = {"t": 0.0, "v": {}}
+
+def files_status():
+    """Existence of each output file, re-checked at most every FILES_STATUS_TTL seconds"""
+    now = time.monotonic()
+    if now - files_status_cache["t"] >= FILES_STATUS_TTL:
+        files_status_cache["v"] = {
             "lanes_xmltv_exists": Path(LANES_XML_PATH).exists(),
             "lanes_m3u_exists": Path(LANES_M3U_PATH).exists(),
             "chrome_m3u_exists": Path(CHROME_M3U_PATH).exists(),
@@ -569,17 +706,40 @@ def api_status():
             "direct_m3u_exists": Path(DIRECT_M3U_PATH).exists(),
             "db_exists": Path(DB_PATH).exists(),
         }
-    })
+        files_status_cache["t"] = now
+    return files_status_cache["v"]
+
+status_json_cache = {"key": None, "body": ""}
+
+@app.route('/api/status')
+def api_status():
+    # Re-encoded only when the refresh state, next run or file check has changed
+    files = files_status()
+    next_run = get_next_run()
+    key = (tuple(last_refresh.values()), next_run, files_status_cache["t"])
+    if status_json_cache["key"] != key:
+        status_json_cache["body"] = json.dumps({
+            "status": "ok",
+            "last_refresh": last_refresh,
+            "next_run": next_run,
+            "config": server_config(),
+            "files": files
+        }, separators=(",", ":"), sort_keys=app.json.sort_keys) + "\n"
+        status_json_cache["key"] = key
+    return Response(status_json_cache["body"], mimetype='application/json')
 
 @app.route('/api/refresh', methods=['POST'])
 def api_refresh():
-    if refresh_lock.locked():
+    # Pending manual job or an overrunning step would make run_refresh skip this one
+    if (refresh_lock.locked() or scheduler.get_job('manual_refresh') is not None
+            or (overrun_step is not None and overrun_step.is_alive())):
         return jsonify({"error": "Refresh already in progress"}), 409
     
-    import threading
-    thread = threading.Thread(target=run_refresh)
-    thread.daemon = True
-    thread.start()
+    # One-off job on the scheduler's worker pool; run_refresh's lock still guards
+    # against overlapping with the cron job or the start-up refresh. No misfire
+    # grace limit: a busy pool delays the refresh instead of dropping it
+    scheduler.add_job(run_refresh, id='manual_refresh', replace_existing=True, max_instances=1,
+                      coalesce=True, misfire_grace_time=None)
     
     return jsonify({"message": "Refresh started"}), 202
 
@@ -589,16 +749,10 @@ scheduler = None
 def init_scheduler():
     global scheduler
     scheduler = BackgroundScheduler(timezone="UTC")
-    parts = REFRESH_CRON.split()
-    if len(parts) == 5:
-        trigger = CronTrigger(
-            minute=parts[0], hour=parts[1], day=parts[2],
-            month=parts[3], day_of_week=parts[4], timezone="UTC"
-        )
-        scheduler.add_job(run_refresh, trigger, id='daily_refresh')
+    if REFRESH_TRIGGER:
+        scheduler.add_job(run_refresh, REFRESH_TRIGGER, id='daily_refresh',
+                          max_instances=1, coalesce=True, misfire_grace_time=600)
         logger.info(f"Scheduled refresh: {REFRESH_CRON} (UTC)")
-    else:
-        logger.warning(f"Invalid cron expression: {REFRESH_CRON}")
     scheduler.start()
     logger.info("Scheduler started")
 
@@ -622,6 +776,7 @@ def main():
     for path in [DB_PATH, LANES_XML_PATH, DIRECT_XML_PATH]:
         Path(path).parent.mkdir(parents=True, exist_ok=True)
     
+    init_db_pragmas()
     init_scheduler()
     
     if not Path(LANES_XML_PATH).exists() or not Path(DIRECT_XML_PATH).exists():
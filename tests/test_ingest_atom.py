@@ -0,0 +1,42 @@
+"""Tests for bin/peacock_ingest_atom.py (run: python -m unittest discover tests)"""
+import sqlite3, sys, unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "bin"))
+import peacock_ingest_atom as ingest
+
+def item(node_id, **attrs):
+    return {"id": node_id, "attributes": {"providerVariantId": f"pv-{node_id}", "title": node_id,
+                                          "displayStartTime": 1_700_000_000_000, **attrs}}
+
+class UpsertEventsTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        ingest.ensure_schema(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def upsert(self, items):
+        rows = [ingest.build_event_params(i)[0] for i in items]
+        failed = ingest.upsert_events(self.conn.cursor(), rows)
+        ids = {r[0] for r in self.conn.execute("SELECT id FROM events")}
+        return failed, ids
+
+    def test_out_of_range_integer_skips_only_that_row(self):
+        failed, ids = self.upsert([item("a"), item("big", displayEndTime=1_700_000_600_000, runtime=10**30), item("b")])
+        self.assertEqual(failed, {"big"})
+        self.assertEqual(ids, {"a", "b"})
+
+    def test_unbindable_value_skips_only_that_row(self):
+        failed, ids = self.upsert([item("a"), item("dict", synopsis={"text": "x"})])
+        self.assertEqual(failed, {"dict"})
+        self.assertEqual(ids, {"a"})
+
+    def test_clean_batch(self):
+        failed, ids = self.upsert([item("a"), item("b")])
+        self.assertEqual(failed, set())
+        self.assertEqual(ids, {"a", "b"})
+
+if __name__ == "__main__":
+    unittest.main()